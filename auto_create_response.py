@@ -1,11 +1,13 @@
 #!./venv/bin/python3
-import subprocess
 import languagemodels as lm
 import conversation as cv
+import simulator as sim
+import prompt_prep
 
 import sys
 import os
 import getopt
+import json
 import time
 import re
 
@@ -142,7 +144,7 @@ def extract_module_content(log_contents):
     return log_contents[start_index:end_index]
 
 
-def generate_verilog(conv, model_type, model_id=""):
+def make_model(model_type, model_id=""):
     if model_type == "ChatGPT4":
         model = lm.ChatGPT4()
     elif model_type == "Claude":
@@ -153,16 +155,41 @@ def generate_verilog(conv, model_type, model_id=""):
         model = lm.PaLM()
     elif model_type == "CodeLLama":
         model = lm.CodeLlama(model_id)
+    elif model_type == "OpenAICompatible":
+        model = lm.OpenAICompatible(model_id)
+
+    return model
+
+
+def generate_verilog(conv, model_type, model_id="", fallback=()):
+    # Fallback models take over when the primary one keeps failing
+    if fallback:
+        model = lm.Failover([make_model(m, model_id) for m in [model_type] + list(fallback)])
+    else:
+        model = make_model(model_type, model_id)
 
     return(model.generate(conv))
 
 
-def verilog_loop(design_prompt,  model_type, outdir="", log=None):
+def verilog_loop(design_prompt,  model_type, outdir="", log=None, sim_timeout=sim.DEFAULT_TIMEOUT,
+                 max_sim_time=sim.DEFAULT_MAX_SIM_TIME, cpu_limit=None, mem_limit=None, fallback=(),
+                 compact="none", model=None, simulate=sim.run_simulation, history_path=sim.HISTORY_FILE):
+    """
+    Generate a testbench and iterate on simulator feedback until 90% transition
+    coverage. model (an AbstractLLM) and simulate (see simulator.run_simulation)
+    replace the model_type backend and run.sh, e.g. for replayed benchmark runs.
+    history_path is the simulator runtime history shared between runs (None: not saved).
+    Returns per-run statistics.
+    """
 
     if outdir != "":
         outdir = outdir + "/"
 
     conv = cv.Conversation(log_file=log)
+    history = sim.RuntimeHistory(history_path)
+    key = sim.design_key(design_prompt)
+    # Sent with the first request and again with every coverage iteration
+    design_prompt = prompt_prep.compact_rtl(design_prompt, compact)
 
 
     conv.add_message("system", "You are an expert in design verification for Verilog code. \
@@ -184,6 +211,8 @@ def verilog_loop(design_prompt,  model_type, outdir="", log=None):
     compiled = False
     iterations = 0
     iterations_fsm = 0
+    stats = {"llm_calls": 0, "phases": {"generate": 0.0, "simulate": 0.0, "analyze": 0.0},
+             "coverage": [], "iterations_to_target": None}
     #filename = os.path.join(outdir,"tb.v")
 
     print("Loop entered")
@@ -193,48 +222,57 @@ def verilog_loop(design_prompt,  model_type, outdir="", log=None):
         print("Iterations: " + str(iterations))
         print("Iterations_FSM: " + str(iterations_fsm))
         # Generate a response
-        response = generate_verilog(conv, model_type)
+        start = time.monotonic()
+        if model is not None:
+            response = model.generate(conv)
+        else:
+            response = generate_verilog(conv, model_type, fallback=fallback)
+        stats["llm_calls"] += 1
+        stats["phases"]["generate"] += time.monotonic() - start
         conv.add_message("assistant", response)
 
         #text = extract_module_content(response)
         #with open('tb.v', 'w') as file:
         #    file.write(text)
         write_code_blocks_to_file(response, 'tb', 'tb.v')
-        #os.system('./run.sh')
-        # Start the script
-        process = subprocess.Popen(['./run.sh'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        # Specify the timeout in seconds
-        wait = 100  # For example, 10 seconds
+        # Start the script in its own process group, sized from past runtimes
+        start = time.monotonic()
+        result = simulate(timeout=history.timeout_for(key, sim_timeout), max_sim_time=max_sim_time,
+                          cpu_limit=cpu_limit, mem_limit=mem_limit)
+        stats["phases"]["simulate"] += time.monotonic() - start
+        start = time.monotonic()
+        print("Simulation status: " + result.status + " (" + str(round(result.elapsed, 1)) + "s)")
 
-        try:
-            process.wait(timeout=wait)
-        except subprocess.TimeoutExpired:
-            print("The script did not complete in time, moving on...")
-            # Optionally, terminate the process if it's not finished
-            process.terminate()
+        compiled = False
+        if result.status == sim.SIM_TIMEOUT:
+            status = "Simulation timeout"
+            message = "The simulation did not complete within " + str(int(result.timeout)) + " seconds. Please fix the testbench so that it terminates: avoid infinite loops and make sure $finish is always reached."
+        elif result.status == sim.SIM_RUNAWAY:
+            status = "Simulation runaway"
+            message = "The simulation ran until the simulated time limit without reaching $finish. Please fix the testbench so that every path ends with $finish and no loop waits forever."
+        elif result.status == sim.SIM_RESOURCE_LIMIT:
+            status = "Simulation resource limit"
+            message = "The simulation was killed for exceeding its CPU or memory limit. Please make the testbench shorter and make sure it terminates with $finish."
+        elif result.status in (sim.SIM_CRASHED, sim.SIM_NO_COVERAGE):
+            status = "Simulation failed"
+            runtime_errors, _ = extract_errors_from_log(sim.SIM_LOG) if os.path.exists(sim.SIM_LOG) else ([], [])
+            message = "The simulation of the testbench failed. Please fix the testbench code. The output of the simulator is as follows:\n" + str(runtime_errors)
+        else:
+            extracted_errors, extracted_warnings = extract_errors_from_log(sim.VCS_LOG)
 
-        file_path = 'vcs.log'  # Replace 'path_to_your_log_file.log' with your actual log file path
-        extracted_errors, extracted_warnings = extract_errors_from_log(file_path)
-       
-        #print(extracted_errors)
-        #print(extracted_warnings)
+            if extracted_errors:
+                status = "Error compiling testbench"
+                #print(status)
 
+                message = "The testbench failed to compile. Please fix the testbench code. The output of VCS is as follows:\n"+ str(extracted_errors)
+            elif  extracted_warnings:
+                status = "Warnings compiling testbench"
+                #print(status)
+                message = "The testbench compiled with warnings. Please fix the testbench code. The output of VCS is as follows:\n"+ str(extracted_warnings)
+            else:
+                compiled = True
+                history.record(key, result.elapsed)
 
-        compiled = False
-        if extracted_errors:
-            status = "Error compiling testbench"
-            #print(status)
-
-            message = "The testbench failed to compile. Please fix the testbench code. The output of VCS is as follows:\n"+ str(extracted_errors)
-        elif  extracted_warnings:
-            status = "Warnings compiling testbench"
-            #print(status)
-            message = "The testbench compiled with warnings. Please fix the testbench code. The output of VCS is as follows:\n"+ str(extracted_warnings)
-        else:
-            compiled = True
-        
-   
         #print(compiled)
 
         if not compiled:
@@ -250,11 +288,12 @@ def verilog_loop(design_prompt,  model_type, outdir="", log=None):
         if compiled:
 
             iterations = 0
-            file_path = 'urgReport/modinfo.txt'
+            file_path = sim.COVERAGE_REPORT
             transition_percent, modified_lines = extract_info_from_file(file_path)
 
             # Printing the results
             print("Extracted Transitions Percent:", transition_percent)
+            stats["coverage"].append(transition_percent)
             #print("Modified state transition lines:")
             #for line in modified_lines:
             #    print(line)
@@ -262,6 +301,7 @@ def verilog_loop(design_prompt,  model_type, outdir="", log=None):
             if float(transition_percent) >= 90:
                 status = "Target Achieved"
                 success = True
+                stats["iterations_to_target"] = stats["llm_calls"]
             elif iterations_fsm >= 10:
                 status = "Iterations Timeout"
                 timeout = True
@@ -275,19 +315,25 @@ def verilog_loop(design_prompt,  model_type, outdir="", log=None):
         with open(os.path.join(outdir,"log_iter_"+str(iterations)+".txt"), 'w') as file:
             file.write('\n'.join(str(i) for i in conv.get_messages()))
             file.write('\n\n Iteration status: ' + status + '\n')
+        stats["phases"]["analyze"] += time.monotonic() - start
 
 
     print("Loop exited")
     #print(success)
     #print(timeout)
+    stats["status"] = status
+    stats["success"] = success
+    return stats
 
 
 
 def main():
-    usage = "Usage: auto_create_verilog.py [--help] --prompt=<prompt>  --model=<llm model> --model_id=<model id> --log=<log file>\n\n\t-h|--help: Prints this usage message\n\n\t-p|--prompt: The initial design prompt for the Verilog module\n\n\t-m|--model: The LLM to use for this generation. Must be one of the following\n\t\t- ChatGPT3p5\n\t\t- ChatGPT4\n\t\t- Claude\n\n\t- CodeLLama\n\n\t-l|--log: [Optional] Log the output of the model to the given file"
+    usage = "Usage: auto_create_verilog.py [--help] --prompt=<prompt>  --model=<llm model> --model_id=<model id> --log=<log file>\n\n\t-h|--help: Prints this usage message\n\n\t-p|--prompt: The initial design prompt for the Verilog module\n\n\t-m|--model: The LLM to use for this generation. Must be one of the following\n\t\t- ChatGPT3p5\n\t\t- ChatGPT4\n\t\t- Claude\n\n\t- CodeLLama\n\t\t- OpenAICompatible (endpoint from OPENAI_BASE_URL)\n\n\t--compact: [Optional] Shrink the RTL in prompts: none (default), strip (comments/whitespace) or fsm (state/transition summary)\n\n\t--fallback: [Optional] Comma-separated models to fail over to when the primary model keeps failing\n\n\t-l|--log: [Optional] Log the output of the model to the given file\n\n\t--timeout: [Optional] Simulation timeout in seconds for designs without runtime history (default: 100)\n\n\t--max_sim_time: [Optional] Simulated time after which a testbench without $finish is stopped\n\n\t--cpu_limit: [Optional] CPU seconds allowed per simulator process\n\n\t--mem_limit: [Optional] Memory in MB allowed per simulator process\n\n\t--history: [Optional] Simulator runtime history file used to size timeouts (default: sim_history.json)"
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hp:n:t:i:m:l", ["help", "prompt=", "model=", "model_id=","log="])
+        opts, args = getopt.getopt(sys.argv[1:], "hp:n:t:i:m:l", ["help", "prompt=", "model=", "model_id=","log=",
+                                                                  "timeout=", "max_sim_time=", "cpu_limit=", "mem_limit=", "fallback=",
+                                                                  "compact=", "history="])
     except getopt.GetoptError as err:
         print(err)
         print(usage)
@@ -296,6 +342,13 @@ def main():
 
     # Default values
     max_iterations = 10
+    sim_timeout = sim.DEFAULT_TIMEOUT
+    max_sim_time = sim.DEFAULT_MAX_SIM_TIME
+    cpu_limit = None
+    mem_limit = None
+    fallback = []
+    compact = "none"
+    history_path = sim.HISTORY_FILE
 
     for opt, arg in opts:
         if opt in ("-h", "--help"):
@@ -311,6 +364,24 @@ def main():
             outdir = arg
         elif opt in ("-l", "--log"):
             log = arg
+        elif opt == "--timeout":
+            sim_timeout = float(arg)
+        elif opt == "--max_sim_time":
+            max_sim_time = int(arg)
+        elif opt == "--cpu_limit":
+            cpu_limit = int(arg)
+        elif opt == "--mem_limit":
+            mem_limit = int(arg)
+        elif opt == "--fallback":
+            fallback = [m.strip() for m in arg.split(",") if m.strip()]
+        elif opt == "--compact":
+            if arg not in prompt_prep.COMPACT_MODES:
+                print("Unknown compact mode: " + arg)
+                print(usage)
+                sys.exit(2)
+            compact = arg
+        elif opt == "--history":
+            history_path = arg
 
 
     # Check if prompt and module are set
@@ -337,7 +408,11 @@ def main():
         if not os.path.exists(outdir):
             os.makedirs(outdir)
 
-    verilog_loop(prompt, model, outdir, log)
+    stats = verilog_loop(prompt, model, outdir, log, sim_timeout, max_sim_time, cpu_limit, mem_limit, fallback, compact,
+                         history_path=history_path)
+    # Read back by corpus_index.py to learn per-design costs
+    with open(os.path.join(outdir, "loop_stats.json"), 'w') as file:
+        json.dump(stats, file, indent=1)
 
 if __name__ == "__main__":
     main()
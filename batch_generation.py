@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import shutil
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import llmclient
+from testbench_generation import (add_model_arguments, build_messages, extract_verilog_only, finalize_tb,
+                                  generate_tb, looks_like_tb, make_clients, tb_path)
+
+# Offline batch submission for the first testbench attempt of a whole corpus
+#
+#   prepare: write the build_messages payloads of every design to a batch request JSONL
+#   submit:  upload it through the provider's batch interface (or the local stand-in)
+#   status:  poll the submitted batch
+#   ingest:  validate results with extract_verilog_only/looks_like_tb, write <stem>_tb.v
+#            and queue the failures
+#   retry:   run the interactive path (testbench_generation.generate_tb) on the queue
+#   run:     all of the above, waiting for the batch to finish
+#
+# Default file names avoid requests.jsonl, which is used for other purposes in the repo root.
+
+DEFAULT_BATCH_FILE = "batch_requests.jsonl"
+ENDPOINT = "/v1/chat/completions"
+DONE_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+def find_designs(paths):
+    """RTL files (.v/.sv) given directly or inside the given directories; generated *_tb files are skipped."""
+    designs = []
+    for path in map(Path, paths):
+        candidates = sorted(p for p in path.rglob("*") if p.suffix in (".v", ".sv")) if path.is_dir() else [path]
+        designs.extend(p for p in candidates if not p.stem.endswith("_tb"))
+    return designs
+
+
+def write_batch_requests(designs, batch_file, model, temperature, max_tokens, extra=None, compact="none"):
+    """One chat-completion request per design, keyed by the absolute design path (custom_id)."""
+    with open(batch_file, "w", encoding="utf-8") as file:
+        for design in designs:
+            rtl_text = design.read_text(encoding="utf-8", errors="ignore")
+            messages, _ = build_messages(rtl_text, design.name, extra, compact)
+            file.write(json.dumps({
+                "custom_id": str(design.resolve()),
+                "method": "POST",
+                "url": ENDPOINT,
+                "body": {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+            }) + "\n")
+    return len(designs)
+
+
+class OpenAIBatch:
+    """Provider batch interface (OpenAI Batch API)."""
+
+    name = "openai"
+
+    def __init__(self, sdk_client):
+        self.client = sdk_client
+
+    def submit(self, batch_file):
+        with open(batch_file, "rb") as file:
+            uploaded = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id):
+        """Output lines followed by error lines, as JSON strings."""
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(self.client.files.content(file_id).text.splitlines())
+        return lines
+
+
+class LocalBatch:
+    """
+    File-based stand-in for the provider batch interface. Requests are answered on
+    the first status poll, either by an OpenAI-compatible endpoint (base_url, e.g.
+    fake_llm_server.py), with a fixed reply or with a minimal testbench that
+    instantiates the request's DUT, and written in the provider's output format.
+    """
+
+    name = "local"
+
+    def __init__(self, workdir="batch_local", base_url=None, reply=None):
+        self.workdir = Path(workdir)
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.reply = reply
+
+    def _respond(self, body):
+        if self.base_url:
+            return llmclient.post_json(self.base_url + "/chat/completions", body)
+        from fake_llm_server import testbench_for
+        return {"id": f"chatcmpl-local-{uuid.uuid4().hex[:8]}", "object": "chat.completion", "model": body.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": self.reply or testbench_for(body["messages"])}}]}
+
+    def submit(self, batch_file):
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(batch_file, self.workdir / f"{batch_id}.input.jsonl")
+        return batch_id
+
+    def status(self, batch_id):
+        output = self.workdir / f"{batch_id}.output.jsonl"
+        if not output.exists():
+            with open(self.workdir / f"{batch_id}.input.jsonl", encoding="utf-8") as src, \
+                    open(output, "w", encoding="utf-8") as dst:
+                for line in src:
+                    request = json.loads(line)
+                    try:
+                        body = self._respond(request["body"])
+                        response, error = {"status_code": 200, "body": body}, None
+                    except llmclient.APIStatusError as e:
+                        response, error = {"status_code": e.status_code, "body": e.body}, None
+                    except Exception as e:
+                        response, error = None, {"code": type(e).__name__, "message": str(e)}
+                    dst.write(json.dumps({"id": f"req_{uuid.uuid4().hex[:8]}", "custom_id": request["custom_id"],
+                                          "response": response, "error": error}) + "\n")
+        return "completed"
+
+    def results(self, batch_id):
+        return (self.workdir / f"{batch_id}.output.jsonl").read_text(encoding="utf-8").splitlines()
+
+
+def state_path(batch_file):
+    return Path(str(batch_file) + ".state.json")
+
+
+def save_state(batch_file, backend, batch_id):
+    state_path(batch_file).write_text(json.dumps({"backend": backend.name, "batch_id": batch_id}), encoding="utf-8")
+
+
+def load_state(batch_file):
+    return json.loads(state_path(batch_file).read_text(encoding="utf-8"))
+
+
+def result_content(result):
+    """Assistant text of one batch output line, or None with the reason it failed."""
+    if result.get("error"):
+        return None, f"error: {result['error']}"
+    response = result.get("response") or {}
+    if response.get("status_code") != 200:
+        return None, f"HTTP {response.get('status_code')}"
+    choices = (response.get("body") or {}).get("choices") or []
+    if not choices:
+        return None, "no choices"
+    return choices[0]["message"].get("content") or "", None
+
+
+def ingest(lines, failures_file):
+    """
+    Write <stem>_tb.v for every valid batch result and queue the rest to
+    failures_file. Returns (written, failures).
+    """
+    written, failures = [], []
+    for line in filter(None, (ln.strip() for ln in lines)):
+        result = json.loads(line)
+        design = Path(result["custom_id"])
+        content, reason = result_content(result)
+        if content is not None:
+            rtl_text = design.read_text(encoding="utf-8", errors="ignore")
+            _, dut_name = build_messages(rtl_text, design.name, None)
+            verilog_tb = extract_verilog_only(content)
+            if looks_like_tb(verilog_tb, dut_name):
+                tb_path(design).write_text(finalize_tb(verilog_tb), encoding="utf-8")
+                written.append(str(design))
+                continue
+            reason = "response is not a valid testbench"
+        failures.append({"custom_id": str(design), "reason": reason})
+
+    with open(failures_file, "w", encoding="utf-8") as file:
+        for failure in failures:
+            file.write(json.dumps(failure) + "\n")
+    return written, failures
+
+
+def missing_results(batch_file, written, failures):
+    """Requests of the batch file that produced no output line at all."""
+    seen = set(written) | {f["custom_id"] for f in failures}
+    with open(batch_file, encoding="utf-8") as file:
+        return [{"custom_id": r["custom_id"], "reason": "no result"} for r in map(json.loads, file)
+                if r["custom_id"] not in seen]
+
+
+def retry_failures(failures_file, args):
+    """Interactive generation for every queued failure; returns the designs that still failed."""
+    with open(failures_file, encoding="utf-8") as file:
+        failures = [json.loads(line) for line in file if line.strip()]
+    if not failures:
+        return []
+    if not args.api_key:
+        print("Error: --api_key is required for interactive retry", file=sys.stderr)
+        return failures
+    clients, sdk_client = make_clients(args)
+    still_failed = []
+    for failure in failures:
+        design = Path(failure["custom_id"])
+        try:
+            tb_path(design).write_text(generate_tb(clients, sdk_client, design, args), encoding="utf-8")
+            print(f"Wrote testbench to: {tb_path(design)} (interactive retry)")
+        except Exception as e:
+            print(f"{design}: interactive retry failed: {e}", file=sys.stderr)
+            still_failed.append(failure)
+    return still_failed
+
+
+def make_backend(args, name=None):
+    if (name or ("local" if args.local else "openai")) == "local":
+        return LocalBatch(args.local_dir, base_url=args.base_url)
+    if not args.api_key:
+        print("Error: --api_key is required for the provider batch interface", file=sys.stderr)
+        sys.exit(1)
+    clients, sdk_client = make_clients(args)
+    return OpenAIBatch(sdk_client(clients[0].keys.acquire()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate first-pass testbenches for a corpus through a batch API")
+    parser.add_argument("command", choices=["prepare", "submit", "status", "ingest", "retry", "run"])
+    parser.add_argument("designs", nargs="*", help="RTL files or directories (prepare/run)")
+    parser.add_argument("--batch_file", default=DEFAULT_BATCH_FILE, help=f"Batch request JSONL (default: {DEFAULT_BATCH_FILE})")
+    parser.add_argument("--failures", default="batch_failures.jsonl", help="Queue of designs for interactive retry")
+    parser.add_argument("--local", action="store_true", help="Use the local file-based batch stand-in")
+    parser.add_argument("--local_dir", default="batch_local", help="Working directory of the local stand-in")
+    parser.add_argument("--poll_interval", type=float, default=60, help="Seconds between status polls (run)")
+    parser.add_argument("--no_retry", action="store_true", help="Only queue failures, do not retry them (run)")
+    add_model_arguments(parser, api_key_required=False)
+    args = parser.parse_args()
+
+    if args.command in ("prepare", "run"):
+        designs = find_designs(args.designs)
+        if not designs:
+            print("Error: no designs found", file=sys.stderr)
+            sys.exit(1)
+        count = write_batch_requests(designs, args.batch_file, args.model, args.temperature, args.max_tokens, args.extra,
+                                     args.compact)
+        print(f"Wrote {count} requests to {args.batch_file}")
+
+    if args.command in ("submit", "run"):
+        backend = make_backend(args)
+        batch_id = backend.submit(args.batch_file)
+        save_state(args.batch_file, backend, batch_id)
+        print(f"Submitted batch {batch_id} ({backend.name})")
+
+    if args.command in ("status", "ingest", "run"):
+        state = load_state(args.batch_file)
+        backend = make_backend(args, state["backend"])
+        status = backend.status(state["batch_id"])
+        while args.command == "run" and status not in DONE_STATES:
+            time.sleep(args.poll_interval)
+            status = backend.status(state["batch_id"])
+        print(f"Batch {state['batch_id']}: {status}")
+
+        if args.command in ("ingest", "run"):
+            if status not in DONE_STATES:
+                print("Error: batch has not finished yet", file=sys.stderr)
+                sys.exit(2)
+            written, failures = ingest(backend.results(state["batch_id"]), args.failures)
+            missing = missing_results(args.batch_file, written, failures)
+            if missing:
+                with open(args.failures, "a", encoding="utf-8") as file:
+                    for failure in missing:
+                        file.write(json.dumps(failure) + "\n")
+            print(f"Ingested {len(written)} testbenches, queued {len(failures) + len(missing)} for retry in {args.failures}")
+
+    if args.command == "retry" or (args.command == "run" and not args.no_retry):
+        still_failed = retry_failures(args.failures, args)
+        if still_failed:
+            print(f"{len(still_failed)} designs failed interactive retry", file=sys.stderr)
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
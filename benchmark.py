@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import languagemodels as lm
+import simulator as sim
+from auto_create_response import make_model, verilog_loop
+from batch_generation import find_designs
+from fsm_extract import extract_fsm
+from prompt_prep import COMPACT_MODES
+from utils import LogStdoutToFile
+
+# Reproducible benchmark of the testbench generation loop
+#   record:  run verilog_loop with a real model and run.sh, saving every LLM exchange
+#            and simulator outcome (logs + coverage report) to one transcript per design
+#   seed:    same, with a deterministic synthetic model and simulator; builds a
+#            transcript set on any machine, without API keys or VCS
+#   run:     replay the transcripts through verilog_loop (ReplayLLM + ReplaySimulator),
+#            entirely offline, and write the metrics as JSON
+#   compare: flag regressions of a run against a baseline
+#
+#   python benchmark.py seed FSM*/
+#   python benchmark.py run --output benchmarks/baseline.json
+#   ... change prompts/parsers ...
+#   python benchmark.py run --baseline benchmarks/baseline.json
+
+DEFAULT_TRANSCRIPTS = os.path.join("benchmarks", "transcripts")
+DEFAULT_WORKDIR = os.path.join("benchmarks", "work")
+TARGET_COVERAGE = 90
+RUN_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), "run.sh"))
+
+# Simulator outputs read by verilog_loop, stored in the transcripts
+SIM_FILES = [sim.VCS_LOG, sim.SIM_LOG, sim.COVERAGE_REPORT]
+
+# Totals compared against the baseline; all of them get worse when they grow,
+# except reached_target. modelled_time is dominated by the recorded model and
+# simulator time, so it is stable. Replay wall time is too short to gate on by
+# default (timer noise alone exceeds 25%); with --wall_time it is compared between
+# runs with --repeat > 1 and must grow by more than twice the repeat spread.
+# Replay misses are expected after a prompt change and only fail with --strict.
+TIME_METRICS = ["modelled_time"]
+COUNT_METRICS = ["llm_calls", "prompt_tokens", "mean_iterations_to_target"]
+
+
+def transcript_name(design):
+    return str(Path(design).with_suffix("")).replace(os.sep, "_") + ".json"
+
+
+def tb_key(cwd="."):
+    """Key of a simulator run in a transcript: hash of the testbench that was simulated."""
+    try:
+        return hashlib.sha1(Path(cwd, "tb.v").read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+class RecordingSimulator:
+    """Wraps a simulate callable and appends the outcome and output files of every run to records."""
+
+    def __init__(self, records, simulate=sim.run_simulation):
+        self.records = records
+        self.simulate = simulate
+
+    def __call__(self, **kwargs):
+        result = self.simulate(**kwargs)
+        files = {}
+        for name in SIM_FILES:
+            if os.path.exists(name):
+                files[name] = Path(name).read_text(errors="ignore")
+        self.records.append({"key": tb_key(), "status": result.status, "returncode": result.returncode,
+                             "elapsed": round(result.elapsed, 3), "files": files})
+        return result
+
+
+class ReplaySimulator:
+    """
+    Restores recorded simulator outputs instead of running run.sh. Runs are matched
+    by tb_key, falling back to recording order like languagemodels.ReplayLLM.
+    """
+
+    def __init__(self, records, strict=False):
+        self.pending = list(records)
+        self.strict = strict
+        self.runs = 0
+        self.misses = 0
+        self.recorded_time = 0.0
+
+    def __call__(self, timeout=None, **kwargs):
+        key = tb_key()
+        index = next((i for i, record in enumerate(self.pending) if record["key"] == key), None)
+        if index is None:
+            if self.strict or not self.pending:
+                raise lm.TranscriptError(f"no recorded simulation for testbench {str(key)[:12]} (run {self.runs + 1})")
+            index = 0
+            self.misses += 1
+        record = self.pending.pop(index)
+        self.runs += 1
+        self.recorded_time += record["elapsed"]
+
+        sim.clean_outputs(".")
+        for name, text in record["files"].items():
+            os.makedirs(os.path.dirname(name) or ".", exist_ok=True)
+            Path(name).write_text(text)
+        return sim.SimResult(record["status"], record["returncode"], record["elapsed"], timeout)
+
+
+class SyntheticLLM(lm.AbstractLLM):
+    """Deterministic stand-in model: a minimal testbench that names the design and attempt."""
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.calls = 0
+
+    def generate(self, conversation):
+        self.calls += 1
+        return (f"```verilog\nmodule tb();\n  // synthetic testbench for {self.name}, attempt {self.calls}\n"
+                f"  initial begin\n    #10 $finish;\n  end\nendmodule\n```")
+
+
+class SyntheticSimulator:
+    """
+    Deterministic stand-in for run.sh. Per design (seeded by its RTL), a few compile
+    failures are followed by coverage rising in steps towards a cap; the coverage
+    report lists the transitions fsm_extract finds in the design. Runtimes grow with
+    the size of the design. A non-zero seed only changes the run-to-run jitter of the
+    runtimes, as a second recording of the same corpus would.
+    """
+
+    def __init__(self, rtl, seed=0):
+        self.rng = random.Random(sim.design_key(rtl))
+        self.noise = random.Random(f"{sim.design_key(rtl)}:{seed}") if seed else self.rng
+        fsm = extract_fsm(rtl)
+        transitions = []
+        for t in fsm.transitions:
+            arc = f"{t.source or '*'}->{t.target}"
+            if arc not in transitions:
+                transitions.append(arc)
+        self.transitions = transitions or ["S0->S1", "S1->S0"]
+        self.compile_failures = self.rng.choice([0, 0, 0, 1, 2])
+        self.coverage = self.rng.uniform(20, 80)
+        self.step = self.rng.uniform(5, 30)
+        self.cap = 100.0 if self.rng.random() < 0.8 else self.rng.uniform(50, 89)
+        self.runtime = (2 + 0.05 * rtl.count("\n")) * self.rng.uniform(0.8, 1.2)
+        self.runs = 0
+
+    def __call__(self, timeout=None, **kwargs):
+        self.runs += 1
+        sim.clean_outputs(".")
+        elapsed = self.runtime * self.noise.uniform(0.9, 1.1)
+        if self.runs <= self.compile_failures:
+            Path(sim.VCS_LOG).write_text(f"Error-[SE] Syntax error\n  \"tb.v\", {self.rng.randint(3, 40)}: "
+                                         f"token is ';'\n\n")
+            return sim.SimResult(sim.SIM_COMPILE_ERROR, 1, elapsed / 4, timeout)
+
+        covered = math.ceil(len(self.transitions) * min(self.coverage, self.cap) / 100)
+        self.coverage += self.step
+        lines = [f"  {arc}  {i + 1}  {'Covered' if i < covered else 'Not Covered'}"
+                 for i, arc in enumerate(self.transitions)]
+        percent = 100.0 * covered / len(self.transitions)
+        Path(sim.VCS_LOG).write_text("Chronologic VCS simulator (synthetic)\nCPU time: 1.0 seconds\n")
+        Path(sim.SIM_LOG).write_text("$finish called from file \"tb.v\", line 4.\n")
+        os.makedirs(os.path.dirname(sim.COVERAGE_REPORT), exist_ok=True)
+        Path(sim.COVERAGE_REPORT).write_text(
+            f"Transitions {covered} {len(self.transitions)} {percent:.2f}\n"
+            "State, Transition and Sequence Details\n" + "\n".join(lines) + "\nBranch Coverage for Module\n")
+        return sim.SimResult(sim.SIM_OK, 0, elapsed, timeout)
+
+
+def _session(design, workdir, compact, model, simulate):
+    """Run verilog_loop for one design in a fresh working directory; returns (stats, wall time)."""
+    rtl = Path(design).read_text(encoding="utf-8", errors="ignore")
+    run_dir = Path(workdir) / Path(transcript_name(design)).stem
+    shutil.rmtree(run_dir, ignore_errors=True)
+    run_dir.mkdir(parents=True)
+    shutil.copy(design, run_dir)
+    shutil.copy(RUN_SCRIPT, run_dir)
+
+    cwd = os.getcwd()
+    os.chdir(run_dir)
+    start = time.monotonic()
+    try:
+        with LogStdoutToFile("loop.log"):
+            stats = verilog_loop(rtl, None, compact=compact, model=model, simulate=simulate, history_path=None)
+    except lm.TranscriptError as e:
+        stats = {"status": "Transcript mismatch: " + str(e), "success": False}
+    except SystemExit as e:
+        # verilog_loop exits when a response contains no Verilog module
+        stats = {"status": f"Exited with code {e.code}", "success": False}
+    finally:
+        os.chdir(cwd)
+    return stats, time.monotonic() - start
+
+
+def record(designs, transcripts_dir, workdir, compact, make_llm, make_simulator):
+    """Run every design with recording wrappers and save one transcript per design."""
+    os.makedirs(transcripts_dir, exist_ok=True)
+    for design in designs:
+        transcript = {"design": str(design), "compact": compact, "llm": [], "sim": []}
+        model = lm.RecordingLLM(make_llm(design), transcript["llm"])
+        simulate = RecordingSimulator(transcript["sim"], make_simulator(design))
+        stats, _ = _session(design, workdir, compact, model, simulate)
+        with open(os.path.join(transcripts_dir, transcript_name(design)), "w") as file:
+            json.dump(transcript, file, indent=1)
+        print(f"{str(design):40s} {len(transcript['llm']):3d} LLM calls  {stats.get('status')}")
+
+
+def replay(transcript_path, workdir, compact=None, strict=False):
+    """Metrics of one replayed design."""
+    with open(transcript_path) as file:
+        transcript = json.load(file)
+    model = lm.ReplayLLM(transcript["llm"], strict)
+    simulate = ReplaySimulator(transcript["sim"], strict)
+    stats, wall_time = _session(transcript["design"], workdir, compact or transcript.get("compact", "none"),
+                                model, simulate)
+    coverage = stats.get("coverage") or [None]
+    return {
+        "status": stats.get("status"),
+        "success": bool(stats.get("success")),
+        "wall_time": wall_time,
+        "phases": stats.get("phases", {}),
+        "llm_calls": model.calls,
+        "iterations_to_target": stats.get("iterations_to_target"),
+        "final_coverage": coverage[-1],
+        "prompt_tokens": model.prompt_tokens,
+        "recorded_llm_latency": model.recorded_latency,
+        "recorded_sim_time": simulate.recorded_time,
+        # Replayed wall time plus the model and simulator time saved by replaying
+        "modelled_time": wall_time + model.recorded_latency + simulate.recorded_time,
+        "misses": model.misses + simulate.misses,
+    }
+
+
+def run_benchmark(transcripts, workdir, compact=None, strict=False, repeat=1):
+    """Replay every transcript `repeat` times; times are the median over the repeats."""
+    designs = {}
+    for path in transcripts:
+        runs = [replay(path, workdir, compact, strict) for _ in range(repeat)]
+        metrics = runs[0]
+        metrics["wall_time"] = statistics.median(r["wall_time"] for r in runs)
+        metrics["wall_time_spread"] = max(r["wall_time"] for r in runs) - min(r["wall_time"] for r in runs)
+        metrics["modelled_time"] = statistics.median(r["modelled_time"] for r in runs)
+        for phase in metrics["phases"]:
+            metrics["phases"][phase] = statistics.median(r["phases"][phase] for r in runs)
+        designs[Path(path).stem] = metrics
+
+    reached = [m["iterations_to_target"] for m in designs.values() if m["iterations_to_target"]]
+    phases = {}
+    for m in designs.values():
+        for phase, seconds in m["phases"].items():
+            phases[phase] = phases.get(phase, 0.0) + seconds
+    totals = {
+        "designs": len(designs),
+        "reached_target": len(reached),
+        "wall_time": sum(m["wall_time"] for m in designs.values()),
+        "wall_time_spread": sum(m["wall_time_spread"] for m in designs.values()),
+        "modelled_time": sum(m["modelled_time"] for m in designs.values()),
+        "phases": phases,
+        "llm_calls": sum(m["llm_calls"] for m in designs.values()),
+        "prompt_tokens": sum(m["prompt_tokens"] for m in designs.values()),
+        "mean_iterations_to_target": statistics.mean(reached) if reached else None,
+        "misses": sum(m["misses"] for m in designs.values()),
+    }
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "repeat": repeat, "target_coverage": TARGET_COVERAGE, "totals": totals, "designs": designs}
+
+
+def _format(value):
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+def _change(old, new):
+    if old is None or new is None:
+        return None
+    if old == 0:
+        return 0.0 if new == 0 else math.inf
+    return (new - old) / old
+
+
+def _regression(metric, old, new, change):
+    percent = f" (+{100 * change:.1f}%)" if change != math.inf else ""
+    return f"{metric}: {_format(old)} -> {_format(new)}{percent}"
+
+
+def compare(baseline, current, time_threshold=0.25, count_threshold=0.0, min_time=0.05, strict=False,
+            wall_time=False):
+    """
+    Regressions of current against baseline, as a list of messages. Times must also
+    grow by more than min_time seconds. wall_time is only compared when asked for and
+    both runs were repeated, and must also grow by more than twice their combined spread.
+    Replay misses count only when strict.
+    """
+    regressions = []
+    old, new = baseline["totals"], current["totals"]
+    if wall_time and baseline.get("repeat", 1) > 1 and current.get("repeat", 1) > 1:
+        change = _change(old.get("wall_time"), new.get("wall_time"))
+        noise = max(min_time, 2 * (old.get("wall_time_spread", 0.0) + new.get("wall_time_spread", 0.0)))
+        if change is not None and change > time_threshold and new["wall_time"] - old["wall_time"] > noise:
+            regressions.append(_regression("wall_time", old["wall_time"], new["wall_time"], change))
+    for metric in TIME_METRICS + COUNT_METRICS + (["misses"] if strict else []):
+        change = _change(old.get(metric), new.get(metric))
+        if metric in TIME_METRICS:
+            regressed = change is not None and change > time_threshold and new[metric] - old[metric] > min_time
+        else:
+            regressed = change is not None and change > count_threshold
+        if regressed:
+            regressions.append(_regression(metric, old[metric], new[metric], change))
+    if new["reached_target"] < old["reached_target"]:
+        regressions.append(f"reached_target: {old['reached_target']} -> {new['reached_target']}")
+
+    for name, metrics in current["designs"].items():
+        before = baseline["designs"].get(name)
+        if before is None:
+            continue
+        if before["success"] and not metrics["success"]:
+            regressions.append(f"{name}: no longer reaches the target ({metrics['status']})")
+        elif metrics["llm_calls"] > before["llm_calls"] * (1 + count_threshold):
+            regressions.append(f"{name}: llm_calls {before['llm_calls']} -> {metrics['llm_calls']}")
+    return regressions
+
+
+def print_totals(report, baseline=None):
+    totals = report["totals"]
+    rows = [(k, v, baseline and baseline["totals"].get(k)) for k, v in totals.items() if k != "phases"]
+    rows += [("phase_" + k, v, baseline and baseline["totals"]["phases"].get(k)) for k, v in totals["phases"].items()]
+    print(f"{'metric':28s} {'current':>12s}" + (f" {'baseline':>12s} {'change':>8s}" if baseline else ""))
+    for metric, value, old in rows:
+        line = f"{metric:28s} {_format(value):>12s}"
+        if baseline:
+            change = _change(old, value)
+            line += f" {_format(old):>12s}"
+            if change is not None and change != math.inf:
+                line += f" {100 * change:+7.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline, reproducible benchmark of the testbench generation loop")
+    parser.add_argument("command", choices=["record", "seed", "run", "compare"])
+    parser.add_argument("paths", nargs="*", help="record/seed: RTL files or directories; run: transcripts "
+                                                 "(default: all in --transcripts); compare: BASELINE CURRENT")
+    parser.add_argument("--transcripts", default=DEFAULT_TRANSCRIPTS, help=f"Transcript directory (default: {DEFAULT_TRANSCRIPTS})")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help=f"Per-design working directories (default: {DEFAULT_WORKDIR})")
+    parser.add_argument("--compact", choices=COMPACT_MODES, default=None,
+                        help="Prompt compaction (record/seed default: none; run default: as recorded)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed: run-to-run noise (latencies, runtimes); designs behave the same for every seed")
+    parser.add_argument("--model", default="ChatGPT4", help="Model recorded by 'record' (see auto_create_response.py)")
+    parser.add_argument("--model_id", default="", help="Model id for CodeLLama/OpenAICompatible")
+    parser.add_argument("--repeat", type=int, default=1, help="Replays per design; times are the median (run)")
+    parser.add_argument("--strict", action="store_true", help="Fail a design whose requests no longer match the transcript, and count replay misses as regressions")
+    parser.add_argument("--output", default=None, help="Write the run metrics to this JSON file (run)")
+    parser.add_argument("--baseline", default=None, help="Compare the run against this baseline JSON (run)")
+    parser.add_argument("--time_threshold", type=float, default=0.25, help="Allowed relative increase of times (default: 0.25)")
+    parser.add_argument("--count_threshold", type=float, default=0.0, help="Allowed relative increase of counts (default: 0)")
+    parser.add_argument("--wall_time", action="store_true",
+                        help="Also flag replay wall time regressions (needs --repeat > 1 in both runs)")
+    parser.add_argument("--min_time", type=float, default=0.05, help="Time increases below this many seconds are ignored")
+    args = parser.parse_args()
+
+    if args.command in ("record", "seed"):
+        designs = find_designs(args.paths)
+        if not designs:
+            print("Error: no designs found", file=sys.stderr)
+            sys.exit(1)
+        if args.command == "record":
+            record(designs, args.transcripts, args.workdir, args.compact or "none",
+                   lambda design: make_model(args.model, args.model_id), lambda design: sim.run_simulation)
+        else:
+            record(designs, args.transcripts, args.workdir, args.compact or "none",
+                   lambda design: SyntheticLLM(design.name),
+                   lambda design: SyntheticSimulator(design.read_text(encoding="utf-8", errors="ignore"), args.seed))
+            # Model latencies of the synthetic transcripts, so modelled_time is meaningful
+            for design in designs:
+                path = os.path.join(args.transcripts, transcript_name(design))
+                with open(path) as file:
+                    transcript = json.load(file)
+                rng = random.Random(transcript_name(design) + (f":{args.seed}" if args.seed else ""))
+                for exchange in transcript["llm"]:
+                    exchange["latency"] = round(rng.uniform(4, 40), 3)
+                with open(path, "w") as file:
+                    json.dump(transcript, file, indent=1)
+        return
+
+    if args.command == "compare":
+        if len(args.paths) != 2:
+            parser.error("compare needs BASELINE and CURRENT")
+        baseline, current = (json.loads(Path(p).read_text()) for p in args.paths)
+    else:
+        transcripts = args.paths or sorted(str(p) for p in Path(args.transcripts).glob("*.json"))
+        if not transcripts:
+            print(f"Error: no transcripts in {args.transcripts} (create them with 'record' or 'seed')", file=sys.stderr)
+            sys.exit(1)
+        current = run_benchmark(transcripts, args.workdir, args.compact, args.strict, args.repeat)
+        if args.output:
+            os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+            with open(args.output, "w") as file:
+                json.dump(current, file, indent=1)
+        baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+
+    print_totals(current, baseline)
+    if baseline:
+        regressions = compare(baseline, current, args.time_threshold, args.count_threshold, args.min_time, args.strict,
+                              args.wall_time)
+        misses = current["totals"].get("misses", 0)
+        if misses and not args.strict:
+            print(f"NOTE {misses} replayed requests did not match the transcripts (expected after prompt changes; "
+                  f"use --strict to fail on them)")
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
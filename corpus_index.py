@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import simulator as sim
+from batch_generation import find_designs
+from fsm_extract import DIRECTIVE_REGEX, RESET_NAME_REGEX, extract_fsm, mask_comments, module_ranges, ports
+
+# Corpus index and cost-aware scheduling of testbench generation jobs
+# The index caches per-design facts (module, ports, clock/reset, size, FSM states)
+# in corpus_index.json and only re-parses files whose size, mtime and content
+# changed. It also keeps the job time/iteration history of each design and reads
+# simulator runtimes from the sim_history.json next to it (shared with the jobs,
+# which size their timeouts from it), from which the expected cost of a job is
+# predicted. Jobs are then started longest-expected-first on a fixed number of
+# simulator slots (LPT list scheduling), so the slowest designs no longer set the
+# tail of a sweep.
+# Only recorded job times reorder jobs (see CorpusIndex.expected_costs); before
+# any run the order is the listing order. 'plan --actual' must be scored on
+# transcripts that were not imported into the index, e.g. a second recording
+# ('benchmark.py seed --seed 1').
+#
+#   python corpus_index.py plan --slots 4                    # predicted makespan, listing order vs LPT
+#   python corpus_index.py run --slots 4 --model ChatGPT4    # generate testbenches in LPT order
+#   python corpus_index.py order FSM*/                       # design paths, longest expected first
+
+INDEX_FILE = "corpus_index.json"
+RUN_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), "run.sh"))
+LOOP_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), "auto_create_response.py"))
+KEEP_HISTORY = 20
+
+# Static cost model, which sizes the predicted makespan before any design has run:
+# iterations grow with the number of transitions, simulator time with the size
+LLM_LATENCY = 20.0              # seconds per model call
+SIM_BASE_TIME = 5.0             # seconds per simulator run (vcs + simv + urg)
+SIM_TIME_PER_LINE = 0.05
+TRANSITIONS_PER_ITERATION = 4
+MAX_ITERATIONS = 15
+
+CLOCK_NAME_REGEX = re.compile(r'(?i)cl(?:oc)?k')
+EDGE_REGEX = re.compile(r'\b(posedge|negedge)\s*\(?\s*(\w+)')
+RESET_GUARD_REGEX = re.compile(r'\s*\(?\s*([!~])?\s*(\w+)')
+
+
+def default_paths():
+    return sorted(str(p) for p in Path(".").glob("FSM*") if p.is_dir())
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def describe(rtl):
+    """Static facts of one design."""
+    masked = DIRECTIVE_REGEX.sub(lambda m: ' ' * len(m.group(0)), mask_comments(rtl))
+    ranges = module_ranges(masked)
+    module, header_end = (ranges[0][0], ranges[0][1]) if ranges else (None, None)
+    port_list = ports(masked, header_end) if ranges else []
+    directions = {}
+    for direction, name in port_list:
+        directions.setdefault(direction, []).append(name)
+    inputs = directions.get('input', [])
+
+    edges = {}
+    for edge, signal in EDGE_REGEX.findall(masked):
+        edges.setdefault(signal, edge)
+    # Prefer a clock by name: designs also use data inputs as edge triggers (e.g. posedge f1)
+    candidates = [s for s in inputs if not RESET_NAME_REGEX.search(s)]
+    clock = next((s for s in candidates if s in edges and CLOCK_NAME_REGEX.search(s)), None) or \
+        next((s for s in candidates if CLOCK_NAME_REGEX.search(s)), None) or \
+        next((s for s in edges if s in candidates), None)
+
+    # The FSM reset is the guard of the reset assignments, e.g. '!rst_n'
+    fsm = extract_fsm(rtl)
+    guard = RESET_GUARD_REGEX.match(fsm.reset_signal or "")
+    reset = guard.group(2) if guard else next((s for s in inputs if RESET_NAME_REGEX.search(s)), None)
+    reset_active = None
+    if reset:
+        low = (guard and guard.group(1)) or edges.get(reset) == 'negedge' or \
+            re.search(rf'\b{re.escape(reset)}\s*==\s*(?:1\'b)?0\b', masked)
+        reset_active = "low" if low else "high"
+
+    return {
+        "module": module,
+        "ports": directions,
+        "clock": clock,
+        "reset": reset,
+        "reset_active": reset_active,
+        "lines": rtl.count("\n") + 1,
+        "states": len([s for s in fsm.states if s != 'default']),
+        "transitions": len({(t.source, t.target) for t in fsm.transitions}),
+        "key": sim.design_key(rtl),
+    }
+
+
+class CorpusIndex:
+    """Cached design facts and run history, keyed by design path."""
+
+    def __init__(self, path=INDEX_FILE, history_path=None):
+        self.path = path
+        self.history_path = history_path or os.path.join(os.path.dirname(os.path.abspath(path)), sim.HISTORY_FILE)
+        self.history = sim.RuntimeHistory(self.history_path)
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def refresh(self, paths):
+        """Index the designs under paths; returns (parsed, unchanged, removed) counts."""
+        parsed = unchanged = 0
+        seen = set()
+        for design in find_designs(paths):
+            name = str(design)
+            seen.add(name)
+            stat = design.stat()
+            entry = self.entries.get(name)
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                unchanged += 1
+                continue
+            data = design.read_bytes()
+            digest = _sha1(data)
+            if entry and entry["sha1"] == digest:
+                # Touched but not modified
+                entry["mtime_ns"] = stat.st_mtime_ns
+                unchanged += 1
+                continue
+            facts = describe(data.decode("utf-8", errors="ignore"))
+            facts.update({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": digest,
+                          "history": entry["history"] if entry else {}})
+            self.entries[name] = facts
+            parsed += 1
+
+        removed = [name for name in self.entries if name not in seen and not os.path.exists(name)]
+        for name in removed:
+            del self.entries[name]
+        return parsed, unchanged, len(removed)
+
+    def designs(self, paths):
+        """Indexed designs under paths, in directory-listing order."""
+        return [str(d) for d in find_designs(paths) if str(d) in self.entries]
+
+    def record(self, design, job_time=None, iterations=None):
+        """Remember the outcome of one job of the design (simulator runtimes go to self.history)."""
+        history = self.entries[design].setdefault("history", {})
+        for name, value in (("job_time", job_time), ("iterations", iterations)):
+            if value is not None:
+                runs = history.setdefault(name, [])
+                runs.append(round(value, 3))
+                del runs[:-KEEP_HISTORY]
+
+    def static_cost(self, design):
+        """Static estimate of a job: iterations x (model latency + simulator time)."""
+        entry = self.entries[design]
+        history = entry.get("history", {})
+        if history.get("iterations"):
+            iterations = statistics.median(history["iterations"])
+        else:
+            iterations = min(MAX_ITERATIONS, 1 + (entry["transitions"] or entry["states"]) / TRANSITIONS_PER_ITERATION)
+        sim_time = self.history.expected(entry["key"])
+        if sim_time is None:
+            sim_time = SIM_BASE_TIME + SIM_TIME_PER_LINE * entry["lines"]
+        return iterations * (LLM_LATENCY + sim_time)
+
+    def expected_costs(self, designs):
+        """
+        Predicted wall time of the generation job of each design: its median recorded
+        job time, else the mean over the designs that have one (the static model before
+        any run). Designs without history thus tie and keep their listing order: the
+        static model orders no better than listing order (+0.9% / -0.2% makespan on
+        4 / 8 slots on synthetic transcripts), and calibrating it on recorded job times
+        did worse than the mean (2.2% vs 4.4% on 8 slots with half the designs known).
+        """
+        recorded = {}
+        for d in designs:
+            job_times = self.entries[d].get("history", {}).get("job_time")
+            if job_times:
+                recorded[d] = statistics.median(job_times)
+        if recorded:
+            default = statistics.mean(recorded.values())
+        else:
+            default = statistics.mean(self.static_cost(d) for d in designs) if designs else 0.0
+        return {d: recorded.get(d, default) for d in designs}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def lpt_order(designs, costs):
+    """Designs sorted longest-expected-first; ties keep listing order."""
+    return sorted(designs, key=lambda d: -costs[d])
+
+
+def makespan(order, durations, slots):
+    """
+    Makespan when jobs are started in the given order, each on the slot that
+    becomes free first. Returns (makespan, per-slot design lists).
+    """
+    heap = [(0.0, slot) for slot in range(slots)]
+    assigned = [[] for _ in range(slots)]
+    end = 0.0
+    for design in order:
+        load, slot = heapq.heappop(heap)
+        load += durations[design]
+        assigned[slot].append(design)
+        end = max(end, load)
+        heapq.heappush(heap, (load, slot))
+    return end, assigned
+
+
+def transcript_durations(transcripts_dir):
+    """
+    Recorded job time, successful simulator runtimes and model calls per design of
+    benchmark.py transcripts.
+    """
+    durations = {}
+    for path in sorted(Path(transcripts_dir).glob("*.json")):
+        transcript = json.loads(path.read_text())
+        job_time = sum(e.get("latency", 0.0) for e in transcript["llm"]) + sum(run["elapsed"] for run in transcript["sim"])
+        sim_times = [run["elapsed"] for run in transcript["sim"] if run["status"] == sim.SIM_OK]
+        durations[transcript["design"]] = (job_time, sim_times, len(transcript["llm"]))
+    return durations
+
+
+def run_jobs(index, order, slots, outdir, model, extra_args=()):
+    """Run auto_create_response.py for every design on `slots` workers, in the given order."""
+    lock = threading.Lock()
+
+    def job(design):
+        job_dir = Path(outdir) / Path(design).parent.name / Path(design).stem
+        shutil.rmtree(job_dir, ignore_errors=True)
+        job_dir.mkdir(parents=True)
+        shutil.copy(design, job_dir)
+        shutil.copy(RUN_SCRIPT, job_dir)
+        rtl = Path(design).read_text(encoding="utf-8", errors="ignore")
+        # The job directory is recreated for every run; the runtime history is not kept in it
+        cmd = [sys.executable, LOOP_SCRIPT, "--prompt=" + rtl, "--model=" + model, "--log=log.txt",
+               "--history=" + index.history_path] + list(extra_args)
+        with open(job_dir / "loop.out", "w") as out:
+            returncode, elapsed, _ = sim.run_command(cmd, job_dir, timeout=None, stdout=out)
+        try:
+            stats = json.loads((job_dir / "loop_stats.json").read_text())
+        except (OSError, ValueError):
+            stats = {}
+        with lock:
+            index.record(design, job_time=elapsed, iterations=stats.get("llm_calls"))
+            index.save()
+        print(f"{design:40s} {elapsed:8.1f}s  {stats.get('status', f'exit code {returncode}')}")
+        return elapsed
+
+    with ThreadPoolExecutor(max_workers=slots) as pool:
+        list(pool.map(job, order))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the FSM corpus and schedule generation jobs by expected cost")
+    parser.add_argument("command", choices=["scan", "order", "plan", "import", "run"])
+    parser.add_argument("paths", nargs="*", help="RTL files or directories (default: FSM*/); import: transcript directory")
+    parser.add_argument("--index", default=INDEX_FILE, help=f"Index file (default: {INDEX_FILE})")
+    parser.add_argument("--history", default=None,
+                        help=f"Simulator runtime history shared with the jobs (default: {sim.HISTORY_FILE} next to the index)")
+    parser.add_argument("--slots", type=int, default=os.cpu_count(), help="Parallel simulator slots (default: CPU count)")
+    parser.add_argument("--actual", default=None,
+                        help="plan: evaluate both orders against the durations recorded in these benchmark.py transcripts")
+    parser.add_argument("--model", default="ChatGPT4", help="run: model passed to auto_create_response.py")
+    parser.add_argument("--outdir", default="outputs", help="run: directory of the per-design job directories")
+    parser.add_argument("--loop_args", default="", help="run: extra arguments for auto_create_response.py, e.g. '--compact=fsm'")
+    args = parser.parse_args()
+
+    index = CorpusIndex(args.index, args.history)
+
+    if args.command == "import":
+        if len(args.paths) != 1:
+            parser.error("import needs the transcript directory")
+        index.refresh(default_paths())
+        imported = 0
+        for design, (job_time, sim_times, iterations) in transcript_durations(args.paths[0]).items():
+            if design in index.entries:
+                index.record(design, job_time, iterations)
+                for elapsed in sim_times:
+                    index.history.record(index.entries[design]["key"], elapsed)
+                imported += 1
+        index.save()
+        print(f"Imported the history of {imported} designs into {args.index} and {index.history_path}")
+        return
+
+    paths = args.paths or default_paths()
+    parsed, unchanged, removed = index.refresh(paths)
+    index.save()
+    designs = index.designs(paths)
+    costs = index.expected_costs(designs)
+    order = lpt_order(designs, costs)
+
+    if args.command == "scan":
+        print(f"{'design':40s} {'module':24s} {'clock':8s} {'reset':12s} {'lines':>5s} {'states':>6s} {'cost':>8s}")
+        for d in designs:
+            e = index.entries[d]
+            reset = f"{e['reset']}/{e['reset_active']}" if e["reset"] else "-"
+            print(f"{d:40s} {str(e['module']):24s} {str(e['clock'] or '-'):8s} {reset:12s} {e['lines']:5d} "
+                  f"{e['states']:6d} {costs[d]:8.1f}")
+        print(f"{len(designs)} designs: {parsed} parsed, {unchanged} unchanged, {removed} removed ({args.index})")
+
+    elif args.command == "order":
+        for d in order:
+            print(d)
+
+    elif args.command == "plan":
+        durations, source = costs, "predicted"
+        if args.actual:
+            recorded = transcript_durations(args.actual)
+            durations = {d: recorded[d][0] for d in designs if d in recorded}
+            designs = [d for d in designs if d in durations]
+            order = [d for d in order if d in durations]
+            source = "recorded"
+        listing, _ = makespan(designs, durations, args.slots)
+        lpt, assigned = makespan(order, durations, args.slots)
+        bound = max(sum(durations.values()) / args.slots, max(durations.values(), default=0))
+        learned = sum(1 for d in designs if index.entries[d].get("history", {}).get("job_time"))
+        gain = 100 * (listing - lpt) / listing if listing else 0
+        print(f"{len(designs)} designs on {args.slots} slots ({source} durations; "
+              f"order from the history of {learned} designs, listing order for {len(designs) - learned})")
+        print(f"  listing order makespan: {listing:10.1f}s")
+        print(f"  LPT order makespan:     {lpt:10.1f}s  ({abs(gain):.1f}% {'shorter' if gain >= 0 else 'longer'})")
+        print(f"  lower bound:            {bound:10.1f}s")
+        for slot, jobs in enumerate(assigned):
+            print(f"  slot {slot}: {len(jobs):3d} jobs, {sum(durations[d] for d in jobs):10.1f}s")
+
+    elif args.command == "run":
+        predicted, _ = makespan(order, costs, args.slots)
+        print(f"Running {len(order)} designs on {args.slots} slots, predicted makespan {predicted:.1f}s")
+        run_jobs(index, order, args.slots, args.outdir, args.model, args.loop_args.split())
+
+
+if __name__ == "__main__":
+    main()
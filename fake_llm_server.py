@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fsm_extract import DIRECTIVE_REGEX, mask_comments, module_ranges, ports
+
+# Local stand-in for an OpenAI-compatible chat completions endpoint
+# Replays a fault script (429s with Retry-After, 5xx errors, successes) so the
+# retry, key-pool, rate-limit and failover behaviour of llmclient.py can be
+# exercised without a real provider.
+#
+#   python fake_llm_server.py --port 8089 --faults 429:1,500,503,ok
+#   OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python auto_create_response.py --model=OpenAICompatible ...
+
+DEFAULT_REPLY = """module tb();
+  initial begin
+    $fsdbDumpfile("waves.fsdb");
+    $fsdbDumpvars(0, tb);
+    $finish;
+  end
+endmodule
+"""
+
+RTL_REGEX = re.compile(r'<RTL>([\s\S]*?)</RTL>')
+
+
+def testbench_for(messages):
+    """
+    Minimal testbench instantiating the DUT found in the request (inside <RTL> tags,
+    or a raw RTL message), so that it passes looks_like_tb; DEFAULT_REPLY otherwise.
+    """
+    for message in messages:
+        text = str(message.get('content', ''))
+        m = RTL_REGEX.search(text)
+        masked = DIRECTIVE_REGEX.sub(lambda d: ' ' * len(d.group(0)), mask_comments(m.group(1) if m else text))
+        for name, header_end, _ in module_ranges(masked):
+            if name == 'tb':
+                continue
+            port_list = ports(masked, header_end)
+            declarations = "".join(f"  {'reg' if d == 'input' else 'wire'} {p};\n" for d, p in port_list)
+            connections = ", ".join(f".{p}({p})" for _, p in port_list)
+            return (f"module tb();\n{declarations}  {name} dut ({connections});\n"
+                    + DEFAULT_REPLY.split("\n", 1)[1])
+    return DEFAULT_REPLY
+
+
+def parse_faults(spec):
+    """'429:2,500,ok' -> [(429, 2.0), (500, None), (200, None)]"""
+    faults = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        code, _, delay = item.partition(':')
+        faults.append((200 if code == 'ok' else int(code), float(delay) if delay else None))
+    return faults
+
+
+class FakeLLMServer:
+    """
+    Threaded HTTP server answering POST .../chat/completions. Each request consumes the
+    next entry of the fault script; once it is exhausted every request succeeds.
+    Without a fixed reply, the answer is testbench_for(the request's messages).
+    requests records (api_key, model, status) for every call received.
+    """
+
+    def __init__(self, faults=(), reply=None, host='127.0.0.1', port=0):
+        self.faults = list(parse_faults(faults) if isinstance(faults, str) else faults)
+        self.reply = reply
+        self.requests = []
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _next(self, api_key, model):
+        with self.lock:
+            code, delay = self.faults.pop(0) if self.faults else (200, None)
+            self.requests.append((api_key, model, code))
+        return code, delay
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, code, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.endswith('/chat/completions'):
+                    self._send(404, {'error': {'message': f'unknown path {self.path}'}})
+                    return
+                api_key = self.headers.get('Authorization', '').replace('Bearer ', '') or None
+                code, delay = server._next(api_key, payload.get('model'))
+                if code != 200:
+                    headers = {'Retry-After': str(delay)} if delay is not None else {}
+                    self._send(code, {'error': {'message': f'injected {code}'}}, headers)
+                    return
+                prompt = ' '.join(str(m.get('content', '')) for m in payload.get('messages', []))
+                reply = server.reply or testbench_for(payload.get('messages', []))
+                self._send(200, {
+                    'id': f'chatcmpl-fake-{len(server.requests)}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': payload.get('model'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': reply}}],
+                    'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(reply) // 4},
+                })
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server with injected 429/5xx errors")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--faults", default="", help="Comma-separated script, e.g. 429:1,500,503,ok")
+    parser.add_argument("--reply", type=argparse.FileType('r'), default=None, help="File with the reply text")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.faults, args.reply.read() if args.reply else None, args.host, args.port)
+    print(f"Serving fake LLM API on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
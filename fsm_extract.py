@@ -0,0 +1,553 @@
+import re
+
+# FSM extraction from Verilog/SystemVerilog RTL
+# A small tokenizer and statement parser that finds the state register(s),
+# state constants, state transitions with their guards, and the reset state.
+# All spans are offsets into the original RTL text, so callers can rewrite the
+# source in place (see mutation.py). Designs the heuristics do not recognise
+# (e.g. one-hot equations) yield an FSM without transitions rather than an error.
+
+COMMENT_REGEX = re.compile(r'"(?:\\.|[^"\\\n])*"|//[^\n]*|/\*[\s\S]*?\*/')
+DEFINE_REGEX = re.compile(r'(?m)^[ \t]*`define[ \t]+(\w+)[ \t]+([^\n]*)$')
+DIRECTIVE_REGEX = re.compile(r'(?m)^[ \t]*`(?:define|undef|ifdef|ifndef|elsif|else|endif|include|timescale|default_nettype)\b[^\n]*$')
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<str>"(?:\\.|[^"\\])*")
+  | (?P<num>\d*\s*'[sS]?[bBdDhHoO]\s*[0-9a-fA-F_xXzZ?]+|'[01xXzZ]|\d[\d_]*(?:\.\d+)?)
+  | (?P<id>[A-Za-z_`$][\w$]*)
+  | (?P<op>===|!==|<<<|>>>|<=|>=|==|!=|&&|\|\||<<|>>|::|\S)
+''', re.VERBOSE)
+
+STATE_NAME_REGEX = re.compile(r'(?i)(state|^st$|^ps$|^ns$|^cs$|_st$|^st_|^s$|curr|next|nxt)')
+RESET_NAME_REGEX = re.compile(r'(?i)(rst|reset|clr|clear)')
+SIMPLE_EXPR_REGEX = re.compile(r"[!~]?[\w`$.\[\]:']+(\s*[=!]=\s*[\w`$.\[\]:']+)?")
+
+CASE_KEYWORDS = {'case', 'casez', 'casex'}
+ALWAYS_KEYWORDS = {'always', 'always_ff', 'always_comb', 'always_latch'}
+BLOCK_END = {'end', 'endcase', 'join', 'join_any', 'join_none'}
+PORT_KEYWORDS = {'input', 'output', 'inout'}
+TYPE_KEYWORDS = {'reg', 'wire', 'logic', 'bit', 'signed', 'unsigned', 'integer', 'var', 'tri', 'byte', 'int'}
+
+
+def mask_comments(rtl):
+    """Blank out comments (keeping newlines) so offsets still match the original text."""
+    def blank(m):
+        text = m.group(0)
+        if text.startswith('"'):
+            return text
+        return re.sub(r'[^\n]', ' ', text)
+    return COMMENT_REGEX.sub(blank, rtl)
+
+
+def tokenize(text):
+    """List of (kind, text, start, end) tokens, whitespace dropped."""
+    tokens = []
+    for m in TOKEN_REGEX.finditer(text):
+        kind = m.lastgroup
+        if kind != 'ws':
+            tokens.append((kind, m.group(0), m.start(), m.end()))
+    return tokens
+
+
+def module_ranges(text):
+    """(name, header end, endmodule start) of every module in comment-masked text."""
+    ranges = []
+    tokens = tokenize(text)
+    i = 0
+    while i < len(tokens):
+        if tokens[i][1] == 'module':
+            name = tokens[i + 1][1] if i + 1 < len(tokens) else None
+            depth = 0
+            j = i + 1
+            while j < len(tokens) and not (tokens[j][1] == ';' and depth == 0):
+                if tokens[j][1] == '(':
+                    depth += 1
+                elif tokens[j][1] == ')':
+                    depth -= 1
+                j += 1
+            k = j
+            while k < len(tokens) and tokens[k][1] != 'endmodule':
+                k += 1
+            if j < len(tokens) and k < len(tokens):
+                ranges.append((name, tokens[j][3], tokens[k][2]))
+            i = k
+        i += 1
+    return ranges
+
+
+def ports(text, header_end):
+    """(direction, name) of the ports of the module whose header ends at header_end, ANSI or not."""
+    tokens = tokenize(text)
+    module_start = max(i for i, t in enumerate(tokens) if t[1] == 'module' and t[2] < header_end)
+    found = []
+    names = set()
+    direction = None
+    parens = brackets = 0
+    for kind, tok, s, e in tokens[module_start:]:
+        if tok == 'endmodule':
+            break
+        if tok == '(':
+            parens += 1
+        elif tok == ')':
+            parens -= 1
+        elif tok == '[':
+            brackets += 1
+        elif tok == ']':
+            brackets -= 1
+        elif tok in PORT_KEYWORDS:
+            direction = tok
+        elif tok == ';':
+            direction = None
+        elif direction and kind == 'id' and not brackets and tok not in TYPE_KEYWORDS \
+                and parens == (1 if s < header_end else 0) and tok not in names:
+            names.add(tok)
+            found.append((direction, tok))
+    return found
+
+
+class Guard:
+    """One condition on the path to an assignment: an if condition (possibly negated) or a case item."""
+
+    def __init__(self, kind, text, span, negated=False, subject=None, labels=None):
+        self.kind = kind            # 'if', 'ternary' or 'case'
+        self.text = text
+        self.span = span            # source span of the condition (None for case items)
+        self.negated = negated
+        self.subject = subject
+        self.labels = labels or []
+
+    def __str__(self):
+        if self.kind == 'case':
+            if 'default' in self.labels:
+                return "otherwise"
+            return f"{self.subject} == {' | '.join(self.labels)}"
+        return f"!({self.text})" if self.negated else self.text
+
+
+class Assignment:
+    """A procedural assignment 'lhs = rhs;' / 'lhs <= rhs;' with the guards leading to it."""
+
+    def __init__(self, lhs, rhs, rhs_span, op, guards, block):
+        self.lhs = lhs
+        self.rhs = rhs
+        self.rhs_span = rhs_span
+        self.op = op
+        self.guards = guards
+        self.block = block          # index of the always block
+
+
+class Transition:
+    def __init__(self, source, target, guards, assignment):
+        self.source = source        # state label, or None if the target does not depend on the current state
+        self.target = target
+        self.guards = guards        # guards inside the state case item
+        self.assignment = assignment
+
+    def condition(self):
+        return condition_text(self.guards)
+
+
+def condition_text(guards):
+    """The guards of an assignment joined with '&&' ('always' when unguarded)."""
+    if len(guards) == 1:
+        return str(guards[0])
+    parts = []
+    for g in guards:
+        text = str(g)
+        parts.append(text if SIMPLE_EXPR_REGEX.fullmatch(text) or g.negated else f"({text})")
+    return " && ".join(parts) or "always"
+
+
+class FSM:
+    def __init__(self):
+        self.constants = {}         # name -> value text (parameters, localparams, enums, defines)
+        self.state_reg = None
+        self.next_reg = None
+        self.states = []
+        self.transitions = []
+        self.reset_state = None
+        self.reset_signal = None
+        self.reset_assignments = []
+        self.conditions = []        # distinct if/ternary conditions guarding transitions
+        self.assignments = []
+
+    @property
+    def state_regs(self):
+        return [reg for reg in (self.state_reg, self.next_reg) if reg]
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.assignments = []
+        self.cases = []             # (subject, [labels per item])
+        self.block = 0
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i][1] if i < len(self.tokens) else None
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def at_end(self):
+        return self.pos >= len(self.tokens)
+
+    def skip_group(self, open_tok='(', close_tok=')'):
+        """Skip a balanced group starting at the current token; returns its inner span."""
+        depth = 0
+        start = None
+        while not self.at_end():
+            kind, tok, s, e = self.next()
+            if tok == open_tok:
+                depth += 1
+                if depth == 1:
+                    start = e
+            elif tok == close_tok:
+                depth -= 1
+                if depth == 0:
+                    return (start, s)
+        return (start or len(self.text), len(self.text))
+
+    def skip_statement(self):
+        depth = 0
+        while not self.at_end():
+            tok = self.next()[1]
+            if tok in '([{':
+                depth += 1
+            elif tok in ')]}':
+                depth -= 1
+            elif tok == ';' and depth <= 0:
+                return
+
+    def span_text(self, span):
+        return " ".join(self.text[span[0]:span[1]].split())
+
+    def statement(self, guards):
+        if self.at_end():
+            return
+        tok = self.peek()
+        if tok == 'begin' or tok == 'fork':
+            self.next()
+            if self.peek() == ':':
+                self.pos += 2
+            while not self.at_end() and self.peek() not in BLOCK_END:
+                start = self.pos
+                self.statement(guards)
+                if self.pos == start:
+                    self.pos += 1
+            if not self.at_end():
+                self.next()
+                if self.peek() == ':':
+                    self.pos += 2
+        elif tok in ('unique', 'unique0', 'priority') and self.peek(1) in CASE_KEYWORDS | {'if'}:
+            self.next()
+            self.statement(guards)
+        elif tok == 'if':
+            self.next()
+            span = self.skip_group()
+            cond = self.span_text(span)
+            self.statement(guards + [Guard('if', cond, span)])
+            if self.peek() == 'else':
+                self.next()
+                self.statement(guards + [Guard('if', cond, span, negated=True)])
+        elif tok in CASE_KEYWORDS:
+            self.case(guards)
+        elif tok in ('for', 'while', 'repeat', 'foreach'):
+            self.next()
+            self.skip_group()
+            self.statement(guards)
+        elif tok == 'forever':
+            self.next()
+            self.statement(guards)
+        elif tok == '@':
+            self.next()
+            if self.peek() == '(':
+                self.skip_group()
+            else:
+                self.next()
+            self.statement(guards)
+        elif tok == '#':
+            self.next()
+            if self.peek() == '(':
+                self.skip_group()
+            else:
+                self.next()
+            self.statement(guards)
+        elif tok == ';':
+            self.next()
+        else:
+            self.simple_statement(guards)
+
+    def simple_statement(self, guards):
+        start = self.pos
+        kind, lhs, _, _ = self.tokens[self.pos]
+        i = self.pos + 1
+        if kind == 'id' and i < len(self.tokens) and self.tokens[i][1] == '[':
+            # lhs[index] = ...: not a whole-register assignment, treat as a plain statement
+            self.skip_statement()
+            return
+        if kind == 'id' and i < len(self.tokens) and self.tokens[i][1] in ('=', '<='):
+            op = self.tokens[i][1]
+            self.pos = i + 1
+            if self.peek() == '#':
+                # intra-assignment delay: next_state = #1 IDLE;
+                self.next()
+                if self.peek() == '(':
+                    self.skip_group()
+                else:
+                    self.next()
+            rhs_start = self.tokens[self.pos][2] if not self.at_end() else len(self.text)
+            self.skip_statement()
+            rhs_end = self.tokens[self.pos - 1][2]
+            self.assignment(lhs, (rhs_start, rhs_end), op, guards)
+            return
+        self.pos = start
+        self.skip_statement()
+
+    def assignment(self, lhs, span, op, guards):
+        """Record an assignment; a top-level ternary RHS is split into one assignment per branch."""
+        tokens = [t for t in self.tokens if span[0] <= t[2] < span[1]]
+        depth = 0
+        question = None
+        for j, (kind, tok, s, e) in enumerate(tokens):
+            if tok in '([{':
+                depth += 1
+            elif tok in ')]}':
+                depth -= 1
+            elif tok == '?' and depth == 0 and question is None:
+                question = j
+            elif tok == ':' and depth == 0 and question is not None:
+                # find the matching ':' for nested ternaries in the true branch
+                nested = sum(1 for t in tokens[question + 1:j] if t[1] == '?') - \
+                    sum(1 for t in tokens[question + 1:j] if t[1] == ':')
+                if nested == 0:
+                    cond_span = (span[0], tokens[question][2])
+                    cond = self.span_text(cond_span)
+                    self.assignment(lhs, (tokens[question][3], s), op, guards + [Guard('ternary', cond, cond_span)])
+                    self.assignment(lhs, (e, span[1]), op,
+                                    guards + [Guard('ternary', cond, cond_span, negated=True)])
+                    return
+        start = span[0]
+        while start < span[1] and self.text[start].isspace():
+            start += 1
+        end = span[1]
+        while end > start and self.text[end - 1].isspace():
+            end -= 1
+        rhs = self.text[start:end]
+        if rhs.startswith('(') and rhs.endswith(')') and rhs.count('(') == 1:
+            rhs = rhs[1:-1].strip()
+        self.assignments.append(Assignment(lhs, rhs, (start, end), op, guards, self.block))
+
+    def case(self, guards):
+        self.next()
+        subject = self.span_text(self.skip_group())
+        items = []
+        while not self.at_end() and self.peek() != 'endcase':
+            labels = []
+            if self.peek() == 'default':
+                self.next()
+                if self.peek() == ':':
+                    self.next()
+                labels = ['default']
+            else:
+                depth = 0
+                start = self.tokens[self.pos][2]
+                label_start = start
+                while not self.at_end():
+                    kind, tok, s, e = self.next()
+                    if tok in '([{':
+                        depth += 1
+                    elif tok in ')]}':
+                        depth -= 1
+                    elif tok == ',' and depth == 0:
+                        labels.append(" ".join(self.text[label_start:s].split()))
+                        label_start = e
+                    elif tok == ':' and depth == 0:
+                        labels.append(" ".join(self.text[label_start:s].split()))
+                        break
+                    elif tok == 'endcase':
+                        self.pos -= 1
+                        break
+            items.append(labels)
+            before = self.pos
+            self.statement(guards + [Guard('case', None, None, subject=subject, labels=labels)])
+            if self.pos == before and not self.at_end() and self.peek() != 'endcase':
+                self.pos += 1
+        if not self.at_end():
+            self.next()
+        self.cases.append((subject, items))
+
+    def parse(self):
+        while not self.at_end():
+            tok = self.peek()
+            if tok in ALWAYS_KEYWORDS or tok == 'initial':
+                initial = tok == 'initial'
+                self.next()
+                count = len(self.assignments)
+                self.statement([])
+                if initial:
+                    del self.assignments[count:]
+                self.block += 1
+            else:
+                self.pos += 1
+
+
+def _constants(text, tokens):
+    constants = {}
+    for m in DEFINE_REGEX.finditer(text):
+        constants['`' + m.group(1)] = m.group(2).strip()
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i][1]
+        if tok in ('parameter', 'localparam'):
+            i += 1
+            depth = 0
+            name = None
+            value_start = None
+            while i < len(tokens):
+                kind, t, s, e = tokens[i]
+                if t in '([{':
+                    depth += 1
+                elif t in ')]}':
+                    if depth == 0:
+                        break
+                    depth -= 1
+                elif depth == 0 and t == '=' and name is None:
+                    name = tokens[i - 1][1]
+                    value_start = e
+                elif depth == 0 and t in (',', ';'):
+                    if name:
+                        constants[name] = " ".join(text[value_start:s].split())
+                    name = None
+                    if t == ';':
+                        break
+                i += 1
+        elif tok == 'enum':
+            while i < len(tokens) and tokens[i][1] != '{':
+                i += 1
+            start = i
+            depth = 0
+            while i < len(tokens):
+                t = tokens[i][1]
+                if t == '{':
+                    depth += 1
+                elif t == '}':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                i += 1
+            members = tokens[start + 1:i]
+            expect_name = True
+            for kind, t, s, e in members:
+                if expect_name and kind == 'id':
+                    value = None
+                    constants.setdefault(t, value)
+                    expect_name = False
+                elif t == ',':
+                    expect_name = True
+        i += 1
+    return constants
+
+
+def _is_state_value(rhs, constants):
+    return rhs in constants or rhs.lstrip('`') in constants or \
+        re.fullmatch(r"\d*\s*'[sS]?[bBdDhHoO]\s*[0-9a-fA-F_xXzZ]+|\d+", rhs) is not None
+
+
+def extract_fsm(rtl):
+    """Parse the RTL and return an FSM (state register, states, transitions, reset state)."""
+    text = DIRECTIVE_REGEX.sub(lambda m: ' ' * len(m.group(0)), mask_comments(rtl))
+    fsm = FSM()
+    fsm.constants = _constants(mask_comments(rtl), tokenize(text))
+    parser = _Parser(text)
+    try:
+        parser.parse()
+    except IndexError:
+        pass
+    fsm.assignments = parser.assignments
+
+    subjects = {subject for subject, _ in parser.cases}
+    assigned_values = {}
+    for a in parser.assignments:
+        if _is_state_value(a.rhs, fsm.constants):
+            assigned_values.setdefault(a.lhs, set()).add(a.rhs)
+
+    # Current state: a case subject that is also assigned state values (or is named like one)
+    candidates = [s for s in subjects if re.fullmatch(r'[A-Za-z_]\w*', s) and
+                  (s in assigned_values or STATE_NAME_REGEX.search(s))]
+    def drives(subject):
+        # number of state values assigned inside the items of a case on this subject
+        return sum(1 for a in parser.assignments if _is_state_value(a.rhs, fsm.constants) and
+                   any(g.kind == 'case' and g.subject == subject for g in a.guards))
+
+    for cand in sorted(candidates, key=lambda s: (-drives(s), s not in assigned_values, not STATE_NAME_REGEX.search(s), s)):
+        fsm.state_reg = cand
+        break
+    if fsm.state_reg is None:
+        return fsm
+    # Next state: the register the current state is loaded from (state <= next_state)
+    for a in parser.assignments:
+        if a.lhs == fsm.state_reg and a.rhs != fsm.state_reg and re.fullmatch(r'[A-Za-z_]\w*', a.rhs) and \
+                not _is_state_value(a.rhs, fsm.constants) and (a.rhs in assigned_values or STATE_NAME_REGEX.search(a.rhs)):
+            fsm.next_reg = a.rhs
+            break
+    if fsm.next_reg is None:
+        # Purely combinational next-state logic (next_state is an output of the module)
+        for a in parser.assignments:
+            if a.lhs != fsm.state_reg and STATE_NAME_REGEX.search(a.lhs) and _is_state_value(a.rhs, fsm.constants) and \
+                    any(g.kind == 'case' and g.subject == fsm.state_reg for g in a.guards):
+                fsm.next_reg = a.lhs
+                break
+
+    state_labels = []
+    for subject, items in parser.cases:
+        if subject == fsm.state_reg:
+            for labels in items:
+                state_labels.extend(l for l in labels if l != 'default')
+
+    for a in parser.assignments:
+        if a.lhs not in fsm.state_regs or not _is_state_value(a.rhs, fsm.constants):
+            continue
+        # Position of the innermost case on the current state
+        case_index = None
+        for i, g in enumerate(a.guards):
+            if g.kind == 'case' and g.subject == fsm.state_reg:
+                case_index = i
+        if case_index is not None:
+            labels = a.guards[case_index].labels
+            inner = a.guards[case_index + 1:]
+            for label in labels:
+                fsm.transitions.append(Transition(label, a.rhs, inner, a))
+        elif a.lhs == fsm.state_reg and any(g.kind == 'if' and RESET_NAME_REGEX.search(g.text) for g in a.guards):
+            fsm.reset_assignments.append(a)
+            if fsm.reset_state is None:
+                fsm.reset_state = a.rhs
+                fsm.reset_signal = next(g.text for g in a.guards if g.kind == 'if' and RESET_NAME_REGEX.search(g.text))
+        elif a.lhs == fsm.state_reg and a.guards:
+            fsm.transitions.append(Transition(None, a.rhs, a.guards, a))
+
+    if fsm.reset_state is None and fsm.next_reg:
+        # Reset applied to the next-state register (e.g. 'if (reset) next = IDLE')
+        for t in list(fsm.transitions):
+            if any(g.kind == 'if' and RESET_NAME_REGEX.search(g.text) and not g.negated for g in t.guards):
+                fsm.reset_state = t.target
+                break
+
+    seen = []
+    for name in state_labels + [t.target for t in fsm.transitions] + ([fsm.reset_state] if fsm.reset_state else []):
+        if name not in seen:
+            seen.append(name)
+    fsm.states = seen
+    conditions = {}
+    for t in fsm.transitions:
+        for g in t.guards:
+            if g.kind != 'case' and g.span not in conditions:
+                conditions[g.span] = Guard(g.kind, g.text, g.span)
+    fsm.conditions = list(conditions.values())
+    return fsm
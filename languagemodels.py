@@ -1,17 +1,27 @@
 from abc import ABC, abstractmethod
 
-import openai
+import hashlib
+import json
+import os
+import time
+from conversation import Conversation
+import llmclient
 
-from anthropic import Anthropic
-from anthropic import AsyncAnthropic, HUMAN_PROMPT, AI_PROMPT
+# Provider SDKs (openai, anthropic, google.generativeai, transformers) are imported
+# by the backends that use them, so that replayed runs need none of them installed
 
-import google.generativeai as palm
 
-import os
-from conversation import Conversation
+# One resilient client per provider/model, shared by every instance so that the
+# rate budgets, key cool-downs and circuit breakers survive across generate() calls
+_clients = {}
+
+def client_for(name, prefix):
+    if name not in _clients:
+        _clients[name] = llmclient.ResilientClient.from_env(name, prefix)
+    return _clients[name]
 
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-import torch
+def _prompt_tokens(messages):
+    return sum(llmclient.estimate_tokens(msg['content']) for msg in messages)
 
 
 # Abstract Large Language Model
@@ -33,15 +43,17 @@ class ChatGPT3p5(AbstractLLM):
 
     def __init__(self):
         super().__init__()
-        openai.api_key=os.environ['OPENAI_API_KEY']
+        self.client = client_for("gpt-3.5-turbo-16k", "OPENAI")
 
     def generate(self, conversation: Conversation):
+        import openai
         messages = [{'role' : msg['role'], 'content' : msg['content']} for msg in conversation.get_messages()]
 
-        response = openai.ChatCompletion.create(
+        response = self.client.call(lambda key: openai.ChatCompletion.create(
             model="gpt-3.5-turbo-16k",
             messages = messages,
-        )
+            api_key = key,
+        ), tokens=_prompt_tokens(messages))
 
         return response['choices'][0]['message']['content']
 
@@ -50,15 +62,17 @@ class ChatGPT4(AbstractLLM):
 
     def __init__(self):
         super().__init__()
-        openai.api_key=os.environ['OPENAI_API_KEY']
+        self.client = client_for("gpt-4", "OPENAI")
 
     def generate(self, conversation: Conversation):
+        import openai
         messages = [{'role' : msg['role'], 'content' : msg['content']} for msg in conversation.get_messages()]
 
-        response = openai.ChatCompletion.create(
+        response = self.client.call(lambda key: openai.ChatCompletion.create(
             model="gpt-4",
             messages = messages,
-        )
+            api_key = key,
+        ), tokens=_prompt_tokens(messages))
 
         return response['choices'][0]['message']['content']
 
@@ -67,9 +81,15 @@ class Claude(AbstractLLM):
 
     def __init__(self):
         super().__init__()
-        self.anthropic = Anthropic(
-            api_key=os.environ['ANTHROPIC_API_KEY'],
-        )
+        self.client = client_for("claude-2", "ANTHROPIC")
+        self.anthropic = {}
+
+    def _anthropic(self, key):
+        # Retries are handled by the shared client, not by the SDK
+        from anthropic import Anthropic
+        if key not in self.anthropic:
+            self.anthropic[key] = Anthropic(api_key=key, max_retries=0)
+        return self.anthropic[key]
 
     def generate(self, conversation: Conversation):
         prompt = ""
@@ -81,11 +101,11 @@ class Claude(AbstractLLM):
         prompt += "\n\nAssistant:"
 
 
-        completion = self.anthropic.completions.create(
+        completion = self.client.call(lambda key: self._anthropic(key).completions.create(
             model="claude-2",
             max_tokens_to_sample=3000,
             prompt=prompt,
-        )
+        ), tokens=llmclient.estimate_tokens(prompt) + 3000)
 
         #print(prompt)
         #print(completion.completion)
@@ -96,7 +116,7 @@ class PaLM(AbstractLLM):
 
     def __init__(self):
         super().__init__()
-        palm.configure(api_key=os.environ['PALM_API_KEY'])
+        self.client = client_for("palm", "PALM")
 
     def generate(self, conversation: Conversation):
 
@@ -113,11 +133,111 @@ class PaLM(AbstractLLM):
                 elif message['role'] == 'assistant':
                     messages.append({'author': '1', 'content': message['content']})
 
-        response = palm.chat(context=context, messages=messages)
+        import google.generativeai as palm
+
+        def chat(key):
+            palm.configure(api_key=key)
+            return palm.chat(context=context, messages=messages)
+
+        response = self.client.call(chat, tokens=_prompt_tokens(messages))
         #print(response)
         return response.last
 
 
+class OpenAICompatible(AbstractLLM):
+    """Any OpenAI-compatible chat completions endpoint (local servers, proxies, fake_llm_server.py)."""
+
+    def __init__(self, model_id=""):
+        super().__init__()
+        self.base_url = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+        self.model_id = model_id or os.environ.get('OPENAI_COMPAT_MODEL', 'gpt-4o')
+        self.client = client_for(self.model_id + "@" + self.base_url, "OPENAI")
+
+    def generate(self, conversation: Conversation):
+        messages = [{'role' : msg['role'], 'content' : msg['content']} for msg in conversation.get_messages()]
+
+        response = self.client.call(lambda key: llmclient.post_json(
+            self.base_url + "/chat/completions",
+            {'model': self.model_id, 'messages': messages},
+            api_key=key,
+        ), tokens=_prompt_tokens(messages))
+
+        return response['choices'][0]['message']['content']
+
+
+class Failover(AbstractLLM):
+    """Tries each model in order; a model whose circuit breaker is open is skipped immediately."""
+
+    def __init__(self, models):
+        super().__init__()
+        self.models = models
+
+    def generate(self, conversation: Conversation):
+        return llmclient.failover([(type(model).__name__, lambda model=model: model.generate(conversation))
+                                   for model in self.models])
+
+
+def transcript_key(messages):
+    """Key of a request in a recorded transcript: hash of the exact messages sent."""
+    payload = json.dumps([[msg['role'], msg['content']] for msg in messages])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class TranscriptError(Exception):
+    """A replayed run asked for a response the transcript does not contain."""
+
+
+class RecordingLLM(AbstractLLM):
+    """Passes requests to another model and appends every exchange to a transcript (list of dicts)."""
+
+    def __init__(self, model, transcript):
+        super().__init__()
+        self.model = model
+        self.transcript = transcript
+
+    def generate(self, conversation: Conversation):
+        messages = conversation.get_messages()
+        key = transcript_key(messages)
+        start = time.monotonic()
+        response = self.model.generate(conversation)
+        self.transcript.append({'key': key, 'response': response, 'latency': round(time.monotonic() - start, 3),
+                                'prompt_tokens': _prompt_tokens(messages)})
+        return response
+
+
+class ReplayLLM(AbstractLLM):
+    """
+    Answers from a recorded transcript without any network access. Requests are
+    matched by transcript_key; when the prompt changed since recording, the next
+    exchange in recording order is used instead and counted in self.misses
+    (or TranscriptError is raised if strict).
+    """
+
+    def __init__(self, transcript, strict=False):
+        super().__init__()
+        self.pending = list(transcript)
+        self.strict = strict
+        self.calls = 0
+        self.misses = 0
+        self.recorded_latency = 0.0
+        self.prompt_tokens = 0
+
+    def generate(self, conversation: Conversation):
+        messages = conversation.get_messages()
+        key = transcript_key(messages)
+        index = next((i for i, exchange in enumerate(self.pending) if exchange['key'] == key), None)
+        if index is None:
+            if self.strict or not self.pending:
+                raise TranscriptError(f"no recorded response for request {key[:12]} (call {self.calls + 1})")
+            index = 0
+            self.misses += 1
+        exchange = self.pending.pop(index)
+        self.calls += 1
+        self.recorded_latency += exchange.get('latency', 0.0)
+        self.prompt_tokens += _prompt_tokens(messages)
+        return exchange['response']
+
+
 class CodeLlama(AbstractLLM):
     """CodeLlama Large Language Model."""
 
@@ -126,6 +246,7 @@ class CodeLlama(AbstractLLM):
 
         self.model_id = model_id
 
+        from transformers import CodeLlamaTokenizer, LlamaForCausalLM
         self.tokenizer = CodeLlamaTokenizer.from_pretrained("codellama/CodeLlama-34b-Instruct-hf")
         self.model = LlamaForCausalLM.from_pretrained("codellama/CodeLlama-34b-Instruct-hf", device_map="auto",torch_dtype = "auto")
 
@@ -0,0 +1,323 @@
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from tenacity import Retrying, retry_if_exception, stop_after_attempt
+
+# Resilient client layer shared by all LLM providers
+# Wraps a single provider call with exponential backoff + jitter, Retry-After
+# handling, client-side request/token budgets, an API key pool and a circuit
+# breaker. call_with_failover() moves on to the next configured model when a
+# provider keeps failing.
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_NAMES = ("Timeout", "Connection", "RateLimit", "ServiceUnavailable", "Overloaded", "InternalServer")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while its circuit breaker is open."""
+
+
+class APIStatusError(Exception):
+    """HTTP error returned by an OpenAI-compatible endpoint (see post_json)."""
+
+    def __init__(self, status_code, headers=None, body=""):
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+
+def status_code(exc):
+    """HTTP status of a provider exception (openai, anthropic or APIStatusError), if any."""
+    for obj in (exc, getattr(exc, 'response', None)):
+        for attr in ('status_code', 'http_status'):
+            code = getattr(obj, attr, None)
+            if isinstance(code, int):
+                return code
+    return None
+
+
+def _headers(exc):
+    for obj in (exc, getattr(exc, 'response', None)):
+        headers = getattr(obj, 'headers', None)
+        if headers:
+            return {str(k).lower(): v for k, v in dict(headers).items()}
+    return {}
+
+
+def retry_after(exc):
+    """Seconds to wait as requested by the server (Retry-After / retry-after-ms), or None."""
+    headers = _headers(exc)
+    if 'retry-after-ms' in headers:
+        try:
+            return max(0.0, float(headers['retry-after-ms']) / 1000.0)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def is_retryable(exc):
+    """True for rate limits, server errors, timeouts and connection failures."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    code = status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    if isinstance(exc, (ConnectionError, TimeoutError, urllib.error.URLError)):
+        return True
+    return any(name in type(exc).__name__ for name in RETRYABLE_NAMES)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) used for TPM budgeting."""
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """Client-side requests-per-minute and tokens-per-minute budget (token buckets)."""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm or 0)
+        self.tokens = float(tpm or 0)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens=0):
+        """Block until one request and the given number of tokens fit in the budget."""
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if self.rpm and self.requests < 1:
+                    wait = max(wait, (1 - self.requests) * 60.0 / self.rpm)
+                if self.tpm and self.tokens < tokens:
+                    wait = max(wait, (tokens - self.tokens) * 60.0 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self.requests -= 1
+                    if self.tpm:
+                        self.tokens -= tokens
+                    return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for the given time (provider-wide Retry-After)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class KeyPool:
+    """Round-robin pool of API keys; a rate-limited key cools down before reuse."""
+
+    def __init__(self, keys):
+        self.keys = [key for key in keys if key]
+        if not self.keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self.cooldown = {}
+        self.next = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, var):
+        """Keys from a comma-separated environment variable, e.g. OPENAI_API_KEY=sk-a,sk-b."""
+        return cls(key.strip() for key in os.environ[var].split(','))
+
+    def available(self):
+        now = time.monotonic()
+        return any(self.cooldown.get(key, 0) <= now for key in self.keys)
+
+    def acquire(self):
+        """Next key that is not cooling down; waits for the earliest one otherwise."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for i in range(len(self.keys)):
+                    key = self.keys[(self.next + i) % len(self.keys)]
+                    if self.cooldown.get(key, 0) <= now:
+                        self.next = (self.next + i + 1) % len(self.keys)
+                        return key
+                wait = min(self.cooldown[key] for key in self.keys) - now
+            time.sleep(max(wait, 0.01))
+
+    def cool_down(self, key, seconds):
+        with self.lock:
+            self.cooldown[key] = max(self.cooldown.get(key, 0), time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    Opens after consecutive failed calls (each with its retries used up); lets one
+    trial call through after reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.trial = True   # half-open
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+    def release(self):
+        """End a call that says nothing about the provider's health (rate limit, bad request)."""
+        with self.lock:
+            self.trial = False
+
+
+class ResilientClient:
+    """Runs provider calls through the key pool, rate limiter, retry policy and circuit breaker."""
+
+    def __init__(self, name, keys=None, rpm=None, tpm=None, max_attempts=6, base_delay=1.0, max_delay=60.0,
+                 failure_threshold=5, reset_timeout=60.0):
+        self.name = name
+        self.keys = keys    # None for providers that need no key (local models)
+        self.limiter = RateLimiter(rpm, tpm)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_env(cls, name, prefix, **kwargs):
+        """
+        Configure from <PREFIX>_API_KEY (comma-separated key pool) and the optional
+        <PREFIX>_RPM / <PREFIX>_TPM budgets, e.g. from_env("gpt-4", "OPENAI").
+        """
+        keys = KeyPool.from_env(f"{prefix}_API_KEY") if os.environ.get(f"{prefix}_API_KEY") else None
+        rpm = os.environ.get(f"{prefix}_RPM")
+        tpm = os.environ.get(f"{prefix}_TPM")
+        return cls(name, keys, rpm=int(rpm) if rpm else None, tpm=int(tpm) if tpm else None, **kwargs)
+
+    def _wait(self, retry_state):
+        exc = retry_state.outcome.exception()
+        if status_code(exc) == 429 and self.keys is not None and len(self.keys.keys) > 1 and self.keys.available():
+            return 0    # another key is ready, no need to wait for this one
+        delay = retry_after(exc)
+        if delay is None:
+            # Exponential backoff with full jitter
+            delay = random.uniform(0, self.base_delay * 2 ** (retry_state.attempt_number - 1))
+        return min(delay, self.max_delay)
+
+    def _attempt(self, fn, tokens):
+        self.limiter.acquire(tokens)
+        key = self.keys.acquire() if self.keys is not None else None
+        try:
+            return fn(key)
+        except Exception as exc:
+            if status_code(exc) == 429:
+                delay = retry_after(exc)
+                if self.keys is not None and len(self.keys.keys) > 1:
+                    self.keys.cool_down(key, delay if delay is not None else self.base_delay)
+                elif delay is not None:
+                    self.limiter.pause(delay)
+            raise
+
+    def call(self, fn, tokens=0):
+        """
+        Call fn(api_key) until it succeeds, a non-retryable error is raised or the
+        attempts are used up. tokens is the expected prompt + completion size.
+        A call that used up its attempts counts as one circuit breaker failure;
+        rate limits (429) never do, since the provider is healthy, only throttling.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name}: circuit open after repeated failures")
+        retrying = Retrying(stop=stop_after_attempt(self.max_attempts),
+                            wait=self._wait,
+                            retry=retry_if_exception(is_retryable),
+                            reraise=True)
+        try:
+            result = retrying(self._attempt, fn, tokens)
+        except Exception as exc:
+            if is_retryable(exc) and status_code(exc) != 429:
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return result
+
+
+def failover(options):
+    """
+    options is a list of (name, fn) pairs in order of preference, fn taking no
+    arguments. Returns the first successful result; raises the last error if all failed.
+    """
+    last_error = None
+    for name, fn in options:
+        try:
+            return fn()
+        except Exception as e:
+            last_error = e
+            print(f"{name} failed ({type(e).__name__}: {e}), trying next model")
+    raise last_error
+
+
+def call_with_failover(calls, tokens=0):
+    """calls is a list of (ResilientClient, fn) pairs in order of preference (see failover)."""
+    return failover([(client.name, lambda client=client, fn=fn: client.call(fn, tokens)) for client, fn in calls])
+
+
+def post_json(url, payload, api_key=None, timeout=120):
+    """POST a JSON body to an OpenAI-compatible endpoint; raises APIStatusError on HTTP errors."""
+    headers = {'Content-Type': 'application/json'}
+    if api_key:
+        headers['Authorization'] = f"Bearer {api_key}"
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        raise APIStatusError(e.code, dict(e.headers), e.read().decode('utf-8', errors='ignore')) from None
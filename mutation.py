@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import simulator as sim
+from fsm_extract import DIRECTIVE_REGEX, extract_fsm, mask_comments, module_ranges, ports
+
+# FSM mutation testing of generated testbenches
+# Mutants of the DUT's state logic are woven into a single mutant schema: every
+# mutated expression becomes '(__mutant == K) ? <mutated> : <original>' and the
+# active mutant is picked at run time with +mutant=K, so all mutants cost one
+# compile. Mutant 0 is the original design. A mutant is killed when the DUT
+# outputs traced during the testbench run differ from those of mutant 0, or the
+# run ends differently (timeout, runaway, crash).
+# The testbench is compiled from a copy with its waveform dumps ($fsdb*, $dump*)
+# removed: they are not needed to compare output traces, need VCS debug flags
+# (iverilog has no $fsdb* tasks at all), and every mutant would write the same
+# waves file. Each mutant also runs in its own directory for any other files.
+#
+#   python mutation.py FSM22/controller.v FSM22/controller_tb.v --jobs 8
+
+OPERATORS = ["swap_target", "invert_guard", "wrong_reset", "drop_transition"]
+
+MUTANT_VAR = "__mutant"
+MONITOR_TAG = "__MUTMON"
+BINARY = "simv_mutants"
+
+DUMP_CALL_REGEX = re.compile(r'\$(?:fsdb|dump)\w*\s*(?:\([^;]*\))?\s*;')
+
+SIMULATORS = {
+    # compile command, run command; {sources}, {binary}, {mutant}, {log}, {max_time} are filled in
+    "vcs": (["vcs", "-full64", "-sverilog", "{sources}", "-o", "{binary}", "-l", "{log}"],
+            ["./{binary}", "+mutant={mutant}", "+vcs+finish+{max_time}"]),
+    "iverilog": (["iverilog", "-g2012", "-o", "{binary}", "{sources}"],
+                 ["vvp", "-n", "{binary}", "+mutant={mutant}"]),
+}
+
+SELECTOR = f"""
+function automatic integer {MUTANT_VAR}_select();
+  integer id;
+  if (!$value$plusargs("mutant=%d", id)) id = 0;
+  return id;
+endfunction
+integer {MUTANT_VAR} = {MUTANT_VAR}_select();
+"""
+
+
+class Mutant:
+    def __init__(self, mutant_id, operator, span, replacement, description, line):
+        self.id = mutant_id
+        self.operator = operator
+        self.span = span
+        self.replacement = replacement
+        self.description = description
+        self.line = line
+        self.status = None
+        self.killed = None
+
+    def to_dict(self):
+        return {"id": self.id, "operator": self.operator, "line": self.line, "description": self.description,
+                "status": self.status, "killed": self.killed}
+
+
+def _line(rtl, offset):
+    return rtl.count("\n", 0, offset) + 1
+
+
+def generate_mutants(rtl, swap_targets=3, operators=OPERATORS):
+    """FSM-specific mutants of the RTL, numbered from 1."""
+    fsm = extract_fsm(rtl)
+    mutants = []
+
+    def add(operator, span, replacement, description):
+        mutants.append(Mutant(len(mutants) + 1, operator, span, replacement, description, _line(rtl, span[0])))
+
+    # One site per assignment; an assignment shared by several case labels is mutated once
+    sites = {}
+    for t in fsm.transitions:
+        sites.setdefault(t.assignment.rhs_span, []).append(t)
+    states = [s for s in fsm.states if s != 'default']
+
+    for span, transitions in sites.items():
+        target = transitions[0].target
+        source_states = sorted({t.source or '*' for t in transitions})
+        sources = ", ".join(source_states)
+        alternatives = []
+        if "swap_target" in operators and target in states:
+            start = states.index(target)
+            alternatives = [states[(start + i) % len(states)] for i in range(1, len(states))][:swap_targets]
+            for alt in alternatives:
+                add("swap_target", span, alt, f"{sources} -> {target} becomes -> {alt}")
+        # Staying in a single source state is already covered when it was a swap alternative
+        if "drop_transition" in operators and fsm.state_reg and target != fsm.state_reg and \
+                all(t.source not in (None, target) for t in transitions) and \
+                not (len(source_states) == 1 and source_states[0] in alternatives):
+            add("drop_transition", span, fsm.state_reg, f"{sources} -> {target} dropped (stays in {fsm.state_reg})")
+
+    if "invert_guard" in operators:
+        for guard in fsm.conditions:
+            add("invert_guard", guard.span, f"!({guard.text})", f"condition '{guard.text}' inverted")
+
+    if "wrong_reset" in operators:
+        for a in fsm.reset_assignments:
+            start = states.index(a.rhs) if a.rhs in states else -1
+            alternatives = [states[(start + i) % len(states)] for i in range(1, len(states))
+                            if states[(start + i) % len(states)] != a.rhs][:swap_targets]
+            for alt in alternatives:
+                add("wrong_reset", a.rhs_span, alt, f"reset state {a.rhs} becomes {alt}")
+    return fsm, mutants
+
+
+def build_schema(rtl, mutants):
+    """Single source containing every mutant, selected at run time with +mutant=K."""
+    masked = DIRECTIVE_REGEX.sub(lambda m: ' ' * len(m.group(0)), mask_comments(rtl))
+    by_span = {}
+    for m in mutants:
+        by_span.setdefault(m.span, []).append(m)
+
+    # (start, end, text) edits against the original offsets, applied back to front
+    edits = []
+    for span, site in by_span.items():
+        expr = f"({rtl[span[0]:span[1]].strip()})"
+        for m in reversed(site):
+            expr = f"({MUTANT_VAR} == {m.id}) ? ({m.replacement}) : {expr}"
+        edits.append((span[0], span[1], f"({expr})"))
+
+    # Selector and output monitor in every module that contains a mutation site
+    for _, header_end, end in module_ranges(masked):
+        if not any(header_end <= span[0] < end for span in by_span):
+            continue
+        edits.append((header_end, header_end, SELECTOR))
+        outputs = [name for direction, name in ports(masked, header_end) if direction == 'output']
+        if outputs:
+            fmt = " ".join(["%h"] * len(outputs))
+            edits.append((end, end, f"always @({' or '.join(outputs)}) "
+                                    f"$display(\"{MONITOR_TAG} %0t {fmt}\", $time, {', '.join(outputs)});\n"))
+
+    text = rtl
+    for start, end, replacement in sorted(edits, reverse=True):
+        text = text[:start] + replacement + text[end:]
+    return text
+
+
+def strip_dumps(tb):
+    """Testbench with waveform dump calls replaced by null statements."""
+    return DUMP_CALL_REGEX.sub(";", mask_comments(tb))
+
+
+def _fill(template, **values):
+    cmd = []
+    for part in template:
+        if part == "{sources}":
+            cmd.extend(values["sources"])
+        else:
+            cmd.append(part.format(**values))
+    return cmd
+
+
+def trace(log_path):
+    """Monitored DUT output lines of a run."""
+    try:
+        with open(log_path, 'r', errors='ignore') as file:
+            return [line.strip() for line in file if line.startswith(MONITOR_TAG)]
+    except OSError:
+        return None
+
+
+def run_mutant(workdir, simulator, mutant_id, timeout, max_time):
+    """Run one mutant of the compiled schema in its own directory; returns (status, trace, elapsed)."""
+    _, run_template = SIMULATORS[simulator]
+    run_dir = os.path.join(workdir, f"run_{mutant_id}")
+    os.makedirs(run_dir, exist_ok=True)
+    log = os.path.join(workdir, f"mutant_{mutant_id}.log")
+    binary = os.path.relpath(os.path.join(workdir, BINARY), run_dir)
+    cmd = _fill(run_template, binary=binary, mutant=mutant_id, max_time=max_time)
+    with open(log, 'w') as out:
+        returncode, elapsed, timed_out = sim.run_command(cmd, run_dir, timeout, stdout=out)
+    if timed_out:
+        return sim.SIM_TIMEOUT, trace(log), elapsed
+    with open(log, 'r', errors='ignore') as file:
+        output = file.read()
+    if returncode != 0 or sim.ERROR_REGEX.search(output):
+        return sim.SIM_CRASHED, trace(log), elapsed
+    if simulator == "vcs" and not sim.FINISH_REGEX.search(output):
+        return sim.SIM_RUNAWAY, trace(log), elapsed
+    return sim.SIM_OK, trace(log), elapsed
+
+
+def mutation_test(dut_path, tb_path, workdir="mutants", simulator="vcs", jobs=None, swap_targets=3,
+                  max_time=sim.DEFAULT_MAX_SIM_TIME, timeout=sim.DEFAULT_TIMEOUT):
+    """Compile the mutant schema once, run all mutants in a worker pool and return the report."""
+    rtl = Path(dut_path).read_text(encoding="utf-8", errors="ignore")
+    fsm, mutants = generate_mutants(rtl, swap_targets)
+    report = {"dut": str(dut_path), "testbench": str(tb_path), "state_reg": fsm.state_reg,
+              "mutants": [], "killed": 0, "total": len(mutants), "score": None, "status": None}
+    if not mutants:
+        report["status"] = "no_fsm"
+        return report
+
+    os.makedirs(workdir, exist_ok=True)
+    schema_path = os.path.join(workdir, "schema_" + Path(dut_path).name)
+    Path(schema_path).write_text(build_schema(rtl, mutants), encoding="utf-8")
+
+    tb_copy = os.path.join(workdir, "tb_" + Path(tb_path).name)
+    Path(tb_copy).write_text(strip_dumps(Path(tb_path).read_text(encoding="utf-8", errors="ignore")), encoding="utf-8")
+
+    compile_template, _ = SIMULATORS[simulator]
+    sources = [os.path.abspath(schema_path), os.path.abspath(tb_copy)]
+    cmd = _fill(compile_template, sources=sources, binary=BINARY, log="compile.log")
+    with open(os.path.join(workdir, "compile.out"), 'w') as out:
+        returncode, _, timed_out = sim.run_command(cmd, workdir, sim.MAX_TIMEOUT, stdout=out)
+    if returncode != 0 or timed_out:
+        report["status"] = "compile_error"
+        return report
+
+    golden_status, golden_trace, golden_elapsed = run_mutant(workdir, simulator, 0, timeout, max_time)
+    if golden_status != sim.SIM_OK:
+        report["status"] = "golden_" + golden_status
+        return report
+    # Mutants get a timeout sized from the original design's runtime
+    mutant_timeout = min(timeout, max(sim.MIN_TIMEOUT, sim.TIMEOUT_FACTOR * golden_elapsed))
+
+    def run(mutant):
+        status, mutant_trace, _ = run_mutant(workdir, simulator, mutant.id, mutant_timeout, max_time)
+        mutant.status = status
+        mutant.killed = status != sim.SIM_OK or mutant_trace != golden_trace
+        return mutant
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        list(pool.map(run, mutants))
+
+    killed = sum(1 for m in mutants if m.killed)
+    report.update({"mutants": [m.to_dict() for m in mutants], "killed": killed,
+                   "score": killed / len(mutants), "status": "ok"})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mutation score of a testbench against FSM mutants of its DUT")
+    parser.add_argument("dut", type=Path, help="RTL of the design under test")
+    parser.add_argument("testbench", type=Path, nargs="?", help="Testbench to evaluate (e.g. <stem>_tb.v)")
+    parser.add_argument("--workdir", default="mutants", help="Directory for the schema, binary and logs")
+    parser.add_argument("--simulator", choices=sorted(SIMULATORS), default="vcs", help="Simulator (default: vcs)")
+    parser.add_argument("--jobs", type=int, default=None, help="Parallel mutant runs (default: CPU count)")
+    parser.add_argument("--swap_targets", type=int, default=3, help="Alternative targets per transition/reset")
+    parser.add_argument("--max_sim_time", type=int, default=sim.DEFAULT_MAX_SIM_TIME, help="Simulated time limit")
+    parser.add_argument("--timeout", type=float, default=sim.DEFAULT_TIMEOUT, help="Wall-clock limit per run (s)")
+    parser.add_argument("--report", default=None, help="JSON report (default: <workdir>/mutation_report.json)")
+    parser.add_argument("--list", action="store_true", help="Only list the mutants and write the schema")
+    args = parser.parse_args()
+
+    if args.list:
+        rtl = args.dut.read_text(encoding="utf-8", errors="ignore")
+        fsm, mutants = generate_mutants(rtl, args.swap_targets)
+        for m in mutants:
+            print(f"{m.id:4d} {m.operator:16s} line {m.line:4d}: {m.description}")
+        if mutants:
+            os.makedirs(args.workdir, exist_ok=True)
+            schema_path = os.path.join(args.workdir, "schema_" + args.dut.name)
+            Path(schema_path).write_text(build_schema(rtl, mutants), encoding="utf-8")
+            print(f"{len(mutants)} mutants, schema written to {schema_path}")
+        else:
+            print("No FSM recognised, no mutants generated")
+        return
+
+    if args.testbench is None:
+        parser.error("a testbench is required unless --list is given")
+
+    report = mutation_test(args.dut, args.testbench, args.workdir, args.simulator, args.jobs, args.swap_targets,
+                           args.max_sim_time, args.timeout)
+    report_path = args.report or os.path.join(args.workdir, "mutation_report.json")
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=1)
+
+    if report["status"] != "ok":
+        print(f"Mutation testing not possible: {report['status']}")
+        sys.exit(1)
+    for operator in OPERATORS:
+        ops = [m for m in report["mutants"] if m["operator"] == operator]
+        if ops:
+            print(f"{operator:16s} {sum(m['killed'] for m in ops):4d}/{len(ops):<4d} killed")
+    print(f"Mutation score: {report['killed']}/{report['total']} = {100 * report['score']:.1f}%  ({report_path})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+import argparse
+import re
+import sys
+
+import llmclient
+from fsm_extract import COMMENT_REGEX, condition_text, extract_fsm
+
+# Prompt preparation: shrink the RTL embedded in prompts
+#   none:  raw RTL, unchanged
+#   strip: comments, indentation and blank lines removed
+#   fsm:   port header + declarations + extracted state/transition table instead of
+#          the full body (falls back to 'strip' when no FSM is recognised)
+#
+#   python prompt_prep.py FSM*/ --mode fsm      # token counts before/after over the corpus
+
+COMPACT_MODES = ["none", "strip", "fsm"]
+
+STRING_OR_SPACE_REGEX = re.compile(r'"(?:\\.|[^"\\])*"|[ \t]+')
+HEADER_END_REGEX = re.compile(r'\)\s*;')
+SIGNAL_DECLARATION_REGEX = re.compile(r'(?m)^(?:reg|wire|logic|bit|integer|int)\b[^;]*;')
+CONTINUOUS_ASSIGN_REGEX = re.compile(r'(?m)^assign\s+([A-Za-z_][\w$]*)[^;]*;')
+IDENTIFIER_REGEX = re.compile(r"(?<!['\w$`])[A-Za-z_][\w$]*")
+DECLARATION_REGEX = re.compile(r'(?m)^(?:input|output|inout|parameter|localparam|typedef)\b[^;]*;|^`define\b[^\n]*$')
+
+
+def strip_comments(rtl):
+    """Remove // and /* */ comments; string literals are left alone."""
+    def repl(m):
+        text = m.group(0)
+        if text.startswith('"'):
+            return text
+        return "\n" if "\n" in text else " "
+    return COMMENT_REGEX.sub(repl, rtl)
+
+
+def collapse_whitespace(rtl):
+    """Drop indentation, trailing spaces and blank lines; runs of spaces become one."""
+    lines = []
+    for line in rtl.splitlines():
+        line = STRING_OR_SPACE_REGEX.sub(lambda m: m.group(0) if m.group(0).startswith('"') else " ", line).strip()
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def strip_rtl(rtl):
+    return collapse_whitespace(strip_comments(rtl))
+
+
+def _identifiers(guards):
+    names = []
+    for g in guards:
+        text = f"{g.subject} {' '.join(g.labels)}" if g.kind == 'case' else g.text
+        names.extend(IDENTIFIER_REGEX.findall(text))
+    return names
+
+
+def fsm_summary(rtl):
+    """
+    Port header, port/parameter declarations and a state/transition table, or None
+    if no FSM with transitions was recognised.
+    Internal signals used in guards keep their declarations, continuous assignments
+    and a table of their procedural assignments; if a guard signal has no driver in
+    the module (e.g. a submodule output), None is returned so callers fall back to 'strip'.
+    """
+    fsm = extract_fsm(rtl)
+    if not fsm.transitions:
+        return None
+    stripped = strip_rtl(rtl)
+    module = re.search(r'\bmodule\b', stripped)
+    header_end = HEADER_END_REGEX.search(stripped, module.start() if module else 0)
+    if not module or not header_end:
+        return None
+    body = stripped[header_end.end():]
+    declarations = [" ".join(m.group(0).split()) for m in DECLARATION_REGEX.finditer(body)]
+
+    known = set(IDENTIFIER_REGEX.findall(stripped[:header_end.end()] + " ".join(declarations)))
+    known.update(fsm.states, fsm.constants, fsm.state_regs, ["default"])
+    signal_declarations = [" ".join(m.group(0).split()) for m in SIGNAL_DECLARATION_REGEX.finditer(body)]
+    continuous = [(m.group(1), " ".join(m.group(0).split())) for m in CONTINUOUS_ASSIGN_REGEX.finditer(body)]
+    signal_lines = []
+    pending = _identifiers(g for t in fsm.transitions for g in t.guards)
+    while pending:
+        name = pending.pop(0)
+        if name in known:
+            continue
+        known.add(name)
+        declared = [d for d in signal_declarations if name in IDENTIFIER_REGEX.findall(d)]
+        # 'wire x = expr;' drives the signal like a continuous assignment
+        assigns = [d for d in declared if re.search(rf'\b{re.escape(name)}\s*=[^=]', d)]
+        assigns += [text for lhs, text in continuous if lhs == name]
+        procedural = [a for a in fsm.assignments if a.lhs == name]
+        if not assigns and not procedural:
+            return None
+        declarations.extend(d for d in declared + assigns if d not in declarations)
+        for text in assigns:
+            pending.extend(IDENTIFIER_REGEX.findall(text.split("=", 1)[1]))
+        for a in procedural:
+            signal_lines.append(f"// {a.lhs} {a.op} {a.rhs} : {condition_text(a.guards)}")
+            pending.extend(IDENTIFIER_REGEX.findall(a.rhs) + _identifiers(a.guards))
+
+    lines = [stripped[module.start():header_end.end()]]
+    lines.extend(declarations)
+    lines.append("// FSM summary (datapath and output logic omitted)")
+    regs = f"state register: {fsm.state_reg}"
+    if fsm.next_reg:
+        regs += f", next state: {fsm.next_reg}"
+    lines.append("// " + regs)
+    if fsm.reset_state:
+        lines.append(f"// reset: {fsm.reset_signal or 'reset'} -> {fsm.reset_state}")
+    lines.append("// states: " + ", ".join(s for s in fsm.states if s != 'default'))
+    lines.append("// transitions (from -> to : condition):")
+    for t in fsm.transitions:
+        source = "otherwise" if t.source == 'default' else t.source or '*'
+        lines.append(f"// {source} -> {t.target} : {t.condition()}")
+    if signal_lines:
+        lines.append("// guard signals (signal <= value : condition):")
+        lines.extend(signal_lines)
+    lines.append("endmodule")
+    return "\n".join(lines)
+
+
+def compact_rtl(rtl, mode="none"):
+    """RTL text to embed in prompts for the given COMPACT_MODES entry."""
+    if mode == "none":
+        return rtl
+    stripped = strip_rtl(rtl)
+    if mode == "fsm":
+        summary = fsm_summary(rtl)
+        if summary and len(summary) < len(stripped):
+            return summary
+    return stripped
+
+
+_encodings = {}
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    (token count, exact). Exact counts use tiktoken when it is installed; otherwise
+    the ~4 characters/token estimate from llmclient is returned.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return llmclient.estimate_tokens(text), False
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # tiktoken downloads its vocabularies on first use; offline that fails
+            print(f"tiktoken unavailable ({type(e).__name__}), using estimated token counts", file=sys.stderr)
+            _encodings[model] = None
+    if _encodings[model] is None:
+        return llmclient.estimate_tokens(text), False
+    return len(_encodings[model].encode(text, disallowed_special=())), True
+
+
+def main():
+    from batch_generation import find_designs
+    from testbench_generation import parse_dut_info
+
+    parser = argparse.ArgumentParser(description="Report prompt token reduction of RTL compaction over a corpus")
+    parser.add_argument("designs", nargs="+", help="RTL files or directories")
+    parser.add_argument("--mode", choices=COMPACT_MODES[1:], default="strip", help="Compaction mode (default: strip)")
+    parser.add_argument("--model", default="gpt-4o", help="Model whose tokenizer is used (default: gpt-4o)")
+    parser.add_argument("--show", action="store_true", help="Print the compacted text of every design")
+    args = parser.parse_args()
+
+    total_before = total_after = 0
+    mismatches = 0
+    exact = True
+    print(f"{'design':45s} {'lines':>6s} {'before':>7s} {'after':>7s} {'saved':>6s}  dut")
+    for design in find_designs(args.designs):
+        rtl = design.read_text(encoding="utf-8", errors="ignore")
+        compact = compact_rtl(rtl, args.mode)
+        before, exact_before = count_tokens(rtl, args.model)
+        after, exact_after = count_tokens(compact, args.model)
+        exact = exact and exact_before and exact_after
+
+        # parse_dut_info must give the same module and ports on the compacted text
+        name, header = parse_dut_info(strip_comments(rtl))
+        compact_name, compact_header = parse_dut_info(compact)
+        same = name == compact_name and "".join((header or "").split()) == "".join((compact_header or "").split())
+        mismatches += not same
+
+        total_before += before
+        total_after += after
+        saved = 100.0 * (before - after) / before if before else 0.0
+        print(f"{str(design):45s} {rtl.count(chr(10)) + 1:6d} {before:7d} {after:7d} {saved:5.1f}%  {'ok' if same else 'MISMATCH'}")
+        if args.show:
+            print(compact + "\n")
+
+    saved = 100.0 * (total_before - total_after) / total_before if total_before else 0.0
+    print(f"{'total':45s} {'':6s} {total_before:7d} {total_after:7d} {saved:5.1f}%  "
+          f"{mismatches} mismatches ({'exact tiktoken counts' if exact else 'estimated counts, install tiktoken for exact ones'})")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
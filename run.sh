@@ -1,8 +1,13 @@
 #!/bin/sh
-# VCS Simulation 
-vcs -full64 -sverilog *.v -l vcs.log -kdb -debug_access+all -lca -cm line+tgl+fsm+cond+branch -cm_fsmopt reportWait
+# VCS Simulation
+# Stop here if vcs fails, so that a previous simv and its coverage are never used
+vcs -full64 -sverilog *.v -l vcs.log -kdb -debug_access+all -lca -cm line+tgl+fsm+cond+branch -cm_fsmopt reportWait || exit $?
 
-./simv -cm line+tgl+fsm+cond+branch
+# SIM_MAX_TIME (set by simulator.py) stops a testbench that never reaches $finish
+./simv -cm line+tgl+fsm+cond+branch -l sim.log ${SIM_MAX_TIME:+"+vcs+finish+$SIM_MAX_TIME"}
+sim_status=$?
 
 # Get the coverage detail
 urg -metric line+tgl+fsm+cond+branch -format text -dir simv.vdb
+
+exit $sim_status
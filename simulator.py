@@ -0,0 +1,239 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import time
+
+# Simulator job management
+# Runs run.sh (vcs -> simv -> urg) in its own process group so that a timeout
+# kills every child, and reports each outcome as a distinct status instead of
+# leaving the caller to parse whatever files an earlier run left behind.
+
+SIM_OK = "ok"
+SIM_COMPILE_ERROR = "compile_error"
+SIM_TIMEOUT = "timeout"
+SIM_RUNAWAY = "runaway"
+SIM_RESOURCE_LIMIT = "resource_limit"
+SIM_CRASHED = "crashed"
+SIM_NO_COVERAGE = "no_coverage"
+
+# Files produced by run.sh; removed before every run so a failed run can never
+# be mistaken for a successful one.
+VCS_LOG = "vcs.log"
+SIM_LOG = "sim.log"
+COVERAGE_REPORT = os.path.join("urgReport", "modinfo.txt")
+STALE_OUTPUTS = [VCS_LOG, SIM_LOG, "urgReport", "simv", "simv.daidir", "simv.vdb"]
+
+# Runtime history shared by all jobs; corpus_index.py passes one absolute path
+# to every job so timeouts adapt across runs and the index can read it back.
+HISTORY_FILE = "sim_history.json"
+
+DEFAULT_TIMEOUT = 100       # seconds, used when a design has no history yet
+MIN_TIMEOUT = 30
+MAX_TIMEOUT = 600
+TIMEOUT_FACTOR = 3.0        # headroom over the slowest recent run
+KILL_GRACE = 5              # seconds between SIGTERM and SIGKILL
+
+# Simulated-time limit passed to simv (+vcs+finish+<time>) so that a testbench
+# without a reachable $finish stops on its own instead of burning the timeout.
+DEFAULT_MAX_SIM_TIME = 10000000
+
+FINISH_REGEX = re.compile(r"\$finish called from", re.MULTILINE)
+ERROR_REGEX = re.compile(r"^\s*Error-\[", re.MULTILINE)
+
+# Exit codes a shell reports when simv was killed by a resource limit
+# (128 + SIGXCPU for RLIMIT_CPU, 128 + SIGKILL for the OOM killer or the hard
+# CPU limit). A process killed directly has a negative return code, see classify.
+RESOURCE_EXIT_CODES = {128 + signal.SIGXCPU, 128 + signal.SIGKILL}
+# mem_limit (RLIMIT_AS) makes allocations fail instead of killing the process;
+# vcs and simv then exit with an error such as these in their logs.
+OUT_OF_MEMORY_REGEX = re.compile(r"(?i)out of memory|cannot allocate memory|unable to allocate|"
+                                 r"memory allocation failed|bad_alloc|MemoryError")
+
+
+class SimResult:
+    """Outcome of a single run.sh invocation."""
+
+    def __init__(self, status, returncode=None, elapsed=0.0, timeout=None):
+        self.status = status
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"SimResult(status={self.status!r}, returncode={self.returncode}, elapsed={self.elapsed:.1f}s)"
+
+
+def design_key(rtl):
+    """Stable key for a design, independent of trailing whitespace."""
+    return hashlib.sha1(rtl.strip().encode("utf-8")).hexdigest()[:16]
+
+
+class RuntimeHistory:
+    """Per-design record of simulator runtimes, used to size timeouts."""
+
+    def __init__(self, path=HISTORY_FILE, keep=20):
+        self.path = path
+        self.keep = keep
+        self.runs = self._load()
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as file:
+                    return json.load(file)
+            except (OSError, ValueError):
+                pass
+        return {}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        if not self.path:
+            yield
+            return
+        with open(self.path + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def record(self, key, elapsed):
+        """Remember a successful runtime for the given design."""
+        with self._locked():
+            # Pick up runs recorded by concurrent jobs sharing the file
+            self.runs = self._load() or self.runs
+            runs = self.runs.setdefault(key, [])
+            runs.append(round(elapsed, 3))
+            del runs[:-self.keep]
+            self.save()
+
+    def expected(self, key):
+        """Median runtime of the design, or None if it never ran."""
+        runs = sorted(self.runs.get(key, []))
+        if not runs:
+            return None
+        return runs[len(runs) // 2]
+
+    def timeout_for(self, key, default=DEFAULT_TIMEOUT):
+        """Timeout adapted to the slowest recent run of the design."""
+        runs = self.runs.get(key)
+        if not runs:
+            return default
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, TIMEOUT_FACTOR * max(runs)))
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.runs, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def _with_limits(cmd, cpu_limit, mem_limit):
+    # The limits are set by a wrapping shell rather than a preexec_fn, which is
+    # not safe to use from threads (mutation.py and corpus_index.py run jobs
+    # in a ThreadPoolExecutor). They are inherited by vcs/simv/urg.
+    # cpu_limit is in seconds, mem_limit in megabytes.
+    limits = []
+    if cpu_limit:
+        limits.append(f"ulimit -S -t {int(cpu_limit)} && ulimit -H -t {int(cpu_limit) + KILL_GRACE}")
+    if mem_limit:
+        limits.append(f"ulimit -v {int(mem_limit) * 1024}")
+    if not limits:
+        return list(cmd)
+    return ["/bin/sh", "-c", " && ".join(limits) + ' && exec "$@"', "sh"] + list(cmd)
+
+
+def _kill_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def clean_outputs(cwd="."):
+    """Remove outputs of a previous run."""
+    for name in STALE_OUTPUTS:
+        path = os.path.join(cwd, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def _read(path):
+    try:
+        with open(path, 'r', errors='ignore') as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def classify(returncode, cwd=".", timed_out=False, mem_limit=None):
+    """Map a finished run.sh invocation to a SIM_* status; mem_limit as passed to run_command."""
+    if timed_out:
+        return SIM_TIMEOUT
+    if returncode is not None and returncode < 0:
+        returncode = 128 - returncode   # killed by signal -returncode, as a shell reports it
+    if returncode in RESOURCE_EXIT_CODES:
+        return SIM_RESOURCE_LIMIT
+    vcs_log = _read(os.path.join(cwd, VCS_LOG))
+    sim_log = _read(os.path.join(cwd, SIM_LOG))
+    if mem_limit and returncode and OUT_OF_MEMORY_REGEX.search((vcs_log or "") + (sim_log or "")):
+        return SIM_RESOURCE_LIMIT
+    if vcs_log is None:
+        return SIM_CRASHED
+    if ERROR_REGEX.search(vcs_log):
+        return SIM_COMPILE_ERROR
+    if sim_log is None or ERROR_REGEX.search(sim_log):
+        return SIM_CRASHED
+    if not FINISH_REGEX.search(sim_log):
+        return SIM_RUNAWAY
+    if not os.path.exists(os.path.join(cwd, COVERAGE_REPORT)):
+        return SIM_NO_COVERAGE
+    return SIM_OK
+
+
+def run_command(cmd, cwd=".", timeout=DEFAULT_TIMEOUT, env=None, cpu_limit=None, mem_limit=None, stdout=None):
+    """
+    Run a command in its own process group. On timeout the whole group is sent
+    SIGTERM, then SIGKILL after a grace period. Returns (returncode, elapsed, timed_out).
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(_with_limits(cmd, cpu_limit, mem_limit), cwd=cwd, env=env,
+                               stdout=stdout or subprocess.DEVNULL, stderr=subprocess.STDOUT if stdout else subprocess.DEVNULL,
+                               start_new_session=True)
+    timed_out = False
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        _kill_group(process, signal.SIGTERM)
+        try:
+            process.wait(timeout=KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            _kill_group(process, signal.SIGKILL)
+            process.wait()
+    elapsed = time.monotonic() - start
+
+    # The command may have exited while a backgrounded child is still alive
+    _kill_group(process, signal.SIGKILL)
+    return process.returncode, elapsed, timed_out
+
+
+def run_simulation(cmd=("./run.sh",), cwd=".", timeout=DEFAULT_TIMEOUT, max_sim_time=DEFAULT_MAX_SIM_TIME,
+                   cpu_limit=None, mem_limit=None):
+    """Run the simulation script (see run_command) and return a SimResult."""
+    clean_outputs(cwd)
+
+    env = dict(os.environ)
+    if max_sim_time:
+        env["SIM_MAX_TIME"] = str(int(max_sim_time))
+
+    returncode, elapsed, timed_out = run_command(cmd, cwd, timeout, env, cpu_limit, mem_limit)
+    status = classify(returncode, cwd, timed_out, mem_limit)
+    return SimResult(status, returncode, elapsed, timeout)
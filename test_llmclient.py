@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+import conversation as cv
+import languagemodels as lm
+import llmclient
+from fake_llm_server import FakeLLMServer
+
+# Retry, key rotation, circuit breaker and failover of llmclient.py against the
+# fake OpenAI-compatible server; no real provider or API key is needed.
+
+
+def chat(server, model="fake-model"):
+    def fn(key):
+        return llmclient.post_json(server.base_url + "/chat/completions",
+                                   {"model": model, "messages": [{"role": "user", "content": "hi"}]}, api_key=key)
+    return fn
+
+
+def client(name="fake", keys=("key-a",), **kwargs):
+    kwargs.setdefault("base_delay", 0.01)
+    return llmclient.ResilientClient(name, llmclient.KeyPool(keys) if keys else None, **kwargs)
+
+
+def test_retries_server_errors_until_success():
+    with FakeLLMServer("500,500,500,500,500,ok") as server:
+        c = client(max_attempts=6)
+        result = c.call(chat(server))
+    assert result["choices"][0]["message"]["content"]
+    assert [code for _, _, code in server.requests] == [500, 500, 500, 500, 500, 200]
+    assert c.breaker.failures == 0
+    assert c.breaker.allow()
+
+
+def test_client_error_is_not_retried():
+    with FakeLLMServer("400") as server:
+        with pytest.raises(llmclient.APIStatusError):
+            client().call(chat(server))
+    assert len(server.requests) == 1
+
+
+def test_rate_limit_rotates_to_next_key_without_waiting():
+    with FakeLLMServer("429:30,ok") as server:
+        client(keys=("key-a", "key-b")).call(chat(server))
+    assert [(key, code) for key, _, code in server.requests] == [("key-a", 429), ("key-b", 200)]
+
+
+def test_rate_limit_on_single_key_backs_off(monkeypatch):
+    # Upper end of the jitter range: waits of 0.1, 0.2 and 0.4 s
+    monkeypatch.setattr(llmclient.random, "uniform", lambda low, high: high)
+    with FakeLLMServer("429,429,429,ok") as server:
+        c = client(base_delay=0.1)
+        start = time.monotonic()
+        c.call(chat(server))
+        elapsed = time.monotonic() - start
+    assert [code for _, _, code in server.requests] == [429, 429, 429, 200]
+    assert elapsed >= 0.7
+
+
+def test_rate_limits_do_not_open_the_breaker():
+    with FakeLLMServer("429,429,429,429") as server:
+        c = client(max_attempts=2, failure_threshold=1)
+        for _ in range(2):
+            with pytest.raises(llmclient.APIStatusError):
+                c.call(chat(server))
+        assert c.breaker.allow()
+
+
+def test_breaker_counts_exhausted_calls_not_attempts():
+    with FakeLLMServer("500,500,500,500,500") as server:
+        c = client(max_attempts=2, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with pytest.raises(llmclient.APIStatusError):
+                c.call(chat(server))
+        with pytest.raises(llmclient.CircuitOpenError):
+            c.call(chat(server))
+    # The open breaker rejects the third call without contacting the provider
+    assert len(server.requests) == 4
+
+
+def test_call_with_failover_moves_to_next_client():
+    with FakeLLMServer("503,503") as server:
+        primary = client("primary", max_attempts=2)
+        secondary = client("secondary")
+        result = llmclient.call_with_failover([(primary, chat(server, "primary-model")),
+                                               (secondary, chat(server, "secondary-model"))])
+    assert result["model"] == "secondary-model"
+    assert [(model, code) for _, model, code in server.requests] == \
+        [("primary-model", 503), ("primary-model", 503), ("secondary-model", 200)]
+
+
+def test_failover_model(monkeypatch):
+    with FakeLLMServer("500:0,500:0,500:0,500:0,500:0,500:0") as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "key-a")
+        models = [lm.OpenAICompatible("failing-model"), lm.OpenAICompatible("backup-model")]
+        conv = cv.Conversation()
+        conv.add_message("user", "hi")
+        reply = lm.Failover(models).generate(conv)
+    assert "module tb" in reply
+    assert server.requests[-1][1:] == ("backup-model", 200)
@@ -4,7 +4,9 @@ import re
 from pathlib import Path
 import sys
 import textwrap
-import openai
+
+import llmclient
+import prompt_prep
 
 TB_SYSTEM_PROMPT = """You are an expert hardware verification assistant.
 Return ONLY a Verilog testbench. Do NOT include any explanation, apology, markdown,
@@ -96,7 +98,8 @@ def looks_like_tb(verilog: str, dut_name: str | None) -> bool:
         has_inst = True  # if unknown, don't block on this
     return has_tb and has_fsdb and has_finish and has_inst
 
-def build_messages(rtl_text: str, filename: str, extra_instruction: str | None):
+def build_messages(rtl_text: str, filename: str, extra_instruction: str | None, compact: str = "none"):
+    rtl_text = prompt_prep.compact_rtl(rtl_text, compact)
     dut_name, dut_port_header = parse_dut_info(rtl_text)
     if not dut_name:
         dut_name = "<UNKNOWN_DUT>"
@@ -125,36 +128,81 @@ def call_openai(client, model, messages, temperature, max_tokens):
         max_tokens=max_tokens,
     )
 
-def main():
-    parser = argparse.ArgumentParser(description="Generate a Verilog testbench using gpt-4o and save as <input>_tb.v")
-    parser.add_argument("verilog_file", type=Path, help="Path to the input Verilog RTL file")
-    parser.add_argument("--api_key", required=True, help="OpenAI API key")
+def make_clients(args):
+    """
+    One ResilientClient per model (primary first, then fallbacks) sharing the API key
+    pool, and a factory returning an OpenAI SDK client for a given key.
+    """
+    import openai
+
+    keys = llmclient.KeyPool(key.strip() for key in args.api_key.split(","))
+    clients = [llmclient.ResilientClient(model, keys, rpm=args.rpm, tpm=args.tpm, max_attempts=args.max_attempts)
+               for model in [args.model] + args.fallback_model]
+    sdk_clients = {}
+
+    def sdk_client(key):
+        # Retries are handled by llmclient, not by the SDK
+        if key not in sdk_clients:
+            sdk_clients[key] = openai.OpenAI(api_key=key, base_url=args.base_url, max_retries=0)
+        return sdk_clients[key]
+
+    return clients, sdk_client
+
+def complete(clients, sdk_client, messages, temperature, max_tokens):
+    """Chat completion with backoff, rate budgeting and failover across the configured models."""
+    tokens = sum(llmclient.estimate_tokens(msg["content"]) for msg in messages) + max_tokens
+    calls = [
+        (client, lambda key, model=client.name: call_openai(sdk_client(key), model, messages, temperature, max_tokens))
+        for client in clients
+    ]
+    return llmclient.call_with_failover(calls, tokens)
+
+class NoChoicesError(Exception):
+    """The API returned a completion without choices."""
+
+def add_model_arguments(parser, api_key_required=True):
+    """Model/client options shared by testbench_generation.py and batch_generation.py."""
+    parser.add_argument("--api_key", required=api_key_required, help="OpenAI API key (comma-separated for a pool of keys)")
     parser.add_argument("--model", default="gpt-4o", help="Model name (default: gpt-4o)")
     parser.add_argument("--extra", default=None, help="Optional extra instruction for the TB")
+    parser.add_argument("--compact", choices=prompt_prep.COMPACT_MODES, default="none",
+                        help="Shrink the RTL in the prompt: strip comments/whitespace, or an FSM summary (default: none)")
     parser.add_argument("--temperature", type=float, default=0.2, help="Sampling temperature")
     parser.add_argument("--max_tokens", type=int, default=2000, help="Max tokens for completion")
-    args = parser.parse_args()
+    parser.add_argument("--base_url", default=None, help="OpenAI-compatible endpoint (default: OpenAI)")
+    parser.add_argument("--fallback_model", action="append", default=[], help="Model to fail over to (repeatable)")
+    parser.add_argument("--rpm", type=int, default=None, help="Client-side requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=None, help="Client-side tokens-per-minute budget")
+    parser.add_argument("--max_attempts", type=int, default=6, help="Attempts per model before failing over")
 
-    if not args.verilog_file.exists():
-        print(f"Error: File not found: {args.verilog_file}", file=sys.stderr)
-        sys.exit(1)
+def finalize_tb(verilog_tb: str) -> str:
+    """
+    Strip any trailing non-code lines that might have slipped in.
+    Keep everything up to the last 'endmodule'.
+    """
+    endmatch = list(re.finditer(r"\bendmodule\b", verilog_tb))
+    if endmatch:
+        verilog_tb = verilog_tb[:endmatch[-1].end()].strip()
+    return verilog_tb
 
-    rtl_text = args.verilog_file.read_text(encoding="utf-8", errors="ignore")
+def tb_path(verilog_file: Path) -> Path:
+    """<stem>_tb.v next to the RTL file."""
+    stem = verilog_file.with_suffix("").name
+    return verilog_file.parent / f"{stem}_tb.v"
 
-    # Initialize OpenAI client
-    client = openai.OpenAI(api_key=args.api_key)
+def generate_tb(clients, sdk_client, verilog_file: Path, args) -> str:
+    """
+    Interactive generation for one design: first attempt, one stricter retry,
+    then the fallback scaffold. Raises on an API error in the first attempt.
+    """
+    rtl_text = verilog_file.read_text(encoding="utf-8", errors="ignore")
 
     # 1st attempt
-    messages, dut_name = build_messages(rtl_text, args.verilog_file.name, args.extra)
-    try:
-        completion = call_openai(client, args.model, messages, args.temperature, args.max_tokens)
-    except Exception as e:
-        print(f"OpenAI API error: {e}", file=sys.stderr)
-        sys.exit(2)
+    messages, dut_name = build_messages(rtl_text, verilog_file.name, args.extra, args.compact)
+    completion = complete(clients, sdk_client, messages, args.temperature, args.max_tokens)
 
     if not completion.choices:
-        print("No choices returned from API.", file=sys.stderr)
-        sys.exit(3)
+        raise NoChoicesError("No choices returned from API.")
 
     content = completion.choices[0].message.content or ""
     verilog_tb = extract_verilog_only(content)
@@ -163,7 +211,7 @@ def main():
     if not looks_like_tb(verilog_tb, dut_name):
         messages.append({"role": "user", "content": RETRY_ADVICE.format(dut_name=dut_name)})
         try:
-            retry_completion = call_openai(client, args.model, messages, 0.1, args.max_tokens)
+            retry_completion = complete(clients, sdk_client, messages, 0.1, args.max_tokens)
             content = retry_completion.choices[0].message.content or ""
             verilog_tb = extract_verilog_only(content)
         except Exception as e:
@@ -183,15 +231,32 @@ def main():
         endmodule
         """)
 
-    # Strip any trailing non-code lines that might have slipped in
-    # Keep everything up to the last 'endmodule'
-    endmatch = list(re.finditer(r"\bendmodule\b", verilog_tb))
-    if endmatch:
-        verilog_tb = verilog_tb[:endmatch[-1].end()].strip()
+    return finalize_tb(verilog_tb)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a Verilog testbench using gpt-4o and save as <input>_tb.v")
+    parser.add_argument("verilog_file", type=Path, help="Path to the input Verilog RTL file")
+    add_model_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.verilog_file.exists():
+        print(f"Error: File not found: {args.verilog_file}", file=sys.stderr)
+        sys.exit(1)
+
+    # Initialize OpenAI clients
+    clients, sdk_client = make_clients(args)
+
+    try:
+        verilog_tb = generate_tb(clients, sdk_client, args.verilog_file, args)
+    except NoChoicesError as e:
+        print(e, file=sys.stderr)
+        sys.exit(3)
+    except Exception as e:
+        print(f"OpenAI API error: {e}", file=sys.stderr)
+        sys.exit(2)
 
     # Save to <stem>_tb.v
-    stem = args.verilog_file.with_suffix("").name
-    out_path = args.verilog_file.parent / f"{stem}_tb.v"
+    out_path = tb_path(args.verilog_file)
     out_path.write_text(verilog_tb, encoding="utf-8")
 
     print(f"Wrote testbench to: {out_path}")